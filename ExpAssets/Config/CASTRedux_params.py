@@ -4,7 +4,7 @@
 # Runtime Settings
 #########################################
 collect_demographics = True
-manual_demographics_collection = False
+manual_demographics_collection = True # collected during setup()
 manual_trial_generation = True
 max_trials_per_block = False
 run_practice_blocks = True
@@ -78,3 +78,46 @@ fix_interval_max = 10.0 # sec
 
 feedback_duration = 1.0 # sec
 response_timeout = 1200 # ms
+
+# If True, background noise is generated on the fly in small chunks instead of
+# being played from pre-generated looping clips
+stream_noise = True
+
+# Number of back buffers an unchanged frame must be drawn to before redrawing it
+# is skipped. Only set this on systems known to preserve back buffer contents
+# after a flip, and never to less than the depth of the swap chain (2 for double
+# buffering, 3 for triple buffering): a smaller value flips back buffers that
+# still hold an older frame, briefly showing stale stimuli. 0 = always redraw.
+reuse_back_buffers = 0
+
+# Maximum size (in MB) of the on-disk cache of generated noise clips (only used
+# when stream_noise is False; clips are seeded per participant and session)
+noise_cache_size = 64
+
+# If True, nothing is drawn to the screen and the cost of each frame is measured
+# against a simulated display with the given refresh rate (for benchmarking). The
+# session runs unattended, with scripted responses and no instructions or demos
+headless = False
+headless_refresh_rate = 60 # Hz
+
+# If True, all raw controller/keyboard input is recorded to a binary log for each
+# session (in ExpAssets/Data/input), indexed by trial. If trial data is buffered,
+# each index entry is also linked to its trial's ID in the 'input_trials' table
+record_input = False
+
+# If True, controller RTs are measured with sub-millisecond resolution from the
+# arrival time of each trigger event to the time of the target flip (instead of
+# in whole ms from the start of the response collection loop)
+hires_timing = False
+
+# If True, SDL drops input events the experiment never uses (e.g. mouse motion,
+# analog stick motion) before they reach the event queue
+input_profile = True
+
+# If True, trial data is kept in memory and written to the database in batches at
+# breaks and block ends (and on exit) instead of after every trial
+buffer_trial_data = True
+
+# If True, each trial's full raw trigger trace is stored in the 'trigger_traces'
+# table as a compressed binary blob (see traces.py for reading them back)
+store_trigger_traces = True
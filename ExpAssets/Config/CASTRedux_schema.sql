@@ -58,6 +58,7 @@ CREATE TABLE trials (
 	'block' integer not null,
 	'trial' integer not null,
 	practice boolean not null,
+	input_device text not null,
 	trial_type text not null,
 	alerting_trial text not null,
 	cue_type text not null,
@@ -66,10 +67,56 @@ CREATE TABLE trials (
 	flanker_type text not null,
 	onset_delay float not null,
 	soa integer not null,
+	soa_delivered float not null,
 	response text not null,
 	accuracy text not null,
 	rt text not null,
 	nonresp_max text not null,
-	nonresp_last text not null
+	nonresp_last text not null,
+	nonresp_auc text not null,
+	nonresp_onset text not null
+
+);
+
+CREATE TABLE frame_timing (
+	id integer primary key autoincrement not null,
+	participant_id integer not null references participants(id),
+	'session' integer not null,
+	'block' integer not null,
+	'trial' integer not null,
+	warning_on_sched integer not null,
+	warning_on_actual float,
+	warning_off_sched integer not null,
+	warning_off_actual float,
+	target_on_sched integer not null,
+	target_on_actual float,
+	refresh_ms float,
+	flips integer not null,
+	dropped_frames integer not null,
+	flip_jitter float
+
+);
+
+CREATE TABLE trigger_traces (
+	id integer primary key autoincrement not null,
+	trial_id integer references trials(id),
+	participant_id integer not null references participants(id),
+	'session' integer not null,
+	'block' integer not null,
+	'trial' integer not null,
+	samples integer not null,
+	trace blob not null
+
+);
+
+CREATE TABLE input_trials (
+	id integer primary key autoincrement not null,
+	trial_id integer references trials(id),
+	participant_id integer not null references participants(id),
+	'session' integer not null,
+	'block' integer not null,
+	'trial' integer not null,
+	log_index integer not null,
+	recycled boolean not null
 
 );
@@ -1,5 +1,9 @@
+from time import perf_counter
+
+import numpy as np
 import sdl2
 
+from klibs.KLConstants import TIMEOUT
 from klibs.KLEventQueue import flush
 from klibs.KLResponseListeners import BaseResponseListener
 
@@ -8,32 +12,243 @@ TRIGGER_RIGHT = sdl2.SDL_CONTROLLER_AXIS_TRIGGERRIGHT
 TRIGGER_AXES = (TRIGGER_LEFT, TRIGGER_RIGHT)
 TRIGGER_MAX = 32767
 
+TRIGGER_DTYPE = np.dtype([('time', np.uint32), ('lt', np.int16), ('rt', np.int16)])
+
+
+class TriggerBuffer(object):
+    """A growable buffer of raw trigger samples.
+
+    Samples are stored in a preallocated NumPy structured array with the fields
+    'time' (the timestamp of the sample in ms, relative to the start of the
+    response collection loop), 'lt', and 'rt' (the raw states of the left and
+    right triggers, from 0 to 32767). When full, the buffer doubles in size, so
+    appending samples never allocates a new object per sample.
+
+    Args:
+        size (int, optional): The initial number of samples to allocate space for.
+            Defaults to 1024.
+
+    """
+    def __init__(self, size=1024):
+        self._data = np.zeros(size, dtype=TRIGGER_DTYPE)
+        self._n = 0
+
+    def append(self, t, lt, rt, merge=False):
+        """Adds a sample to the end of the buffer.
 
-class TriggerData(object):
+        Args:
+            t (int): The timestamp of the sample (in ms).
+            lt (int): The raw state of the left trigger.
+            rt (int): The raw state of the right trigger.
+            merge (bool, optional): If True and the last sample in the buffer
+                has the same timestamp, replace it instead of adding a new one.
+                Defaults to False.
 
-    def __init__(self, t, lt=0, rt=0):
-        self._time = t
-        self._lt = lt
-        self._rt = rt
+        """
+        if merge and self._n and self._data['time'][self._n - 1] == t:
+            self._n -= 1
+        elif self._n == len(self._data):
+            self._data = np.concatenate([self._data, np.zeros_like(self._data)])
+        self._data[self._n] = (t, lt, rt)
+        self._n += 1
+
+    def clear(self):
+        """Removes all samples from the buffer, keeping its allocated space.
+
+        """
+        self._n = 0
+
+    def truncate(self, size):
+        """Removes all samples after the first given number of samples.
+
+        Args:
+            size (int): The number of samples to keep.
+
+        """
+        self._n = min(self._n, size)
 
     @property
-    def timestamp(self):
-        """float: The timestamp for the trigger movement.
-        
-        Relative to the onset of the response collection loop.
-        
+    def samples(self):
+        """:obj:`numpy.ndarray`: A view of the samples currently in the buffer."""
+        return self._data[:self._n]
+
+    def max(self):
+        """Gets the maximum state of each trigger over all samples.
+
+        Returns:
+            tuple: The maximum (left, right) trigger states (min = 0.0, max = 1.0),
+            or (0.0, 0.0) if the buffer is empty.
+
         """
-        return self._time
+        if not self._n:
+            return (0.0, 0.0)
+        samples = self.samples
+        lt, rt = (samples['lt'].max(), samples['rt'].max())
+        return (float(lt) / TRIGGER_MAX, float(rt) / TRIGGER_MAX)
+
+    def last(self):
+        """Gets the state of each trigger as of the most recent sample.
+
+        Returns:
+            tuple: The last (left, right) trigger states (min = 0.0, max = 1.0),
+            or (0.0, 0.0) if the buffer is empty.
+
+        """
+        if not self._n:
+            return (0.0, 0.0)
+        sample = self._data[self._n - 1]
+        return (float(sample['lt']) / TRIGGER_MAX, float(sample['rt']) / TRIGGER_MAX)
+
+    def crossing(self, threshold, trigger='left'):
+        """Gets the time at which a trigger first reached a given threshold.
+
+        Args:
+            threshold (float): The threshold to check for (min = 0.0, max = 1.0).
+            trigger (str, optional): The trigger to check ('left' or 'right').
+                Defaults to 'left'.
+
+        Returns:
+            int: The timestamp (in ms) of the first sample where the trigger was
+            at or above the threshold, or None if it never was.
+
+        """
+        values = self.samples['lt' if trigger == 'left' else 'rt']
+        above = values >= threshold * TRIGGER_MAX
+        if not above.any():
+            return None
+        return int(self.samples['time'][np.argmax(above)])
+
+    def __len__(self):
+        return self._n
+
+
+
+class TriggerStat(object):
+    """A statistic computed incrementally from a trigger's samples as they arrive.
+
+    Trigger stats are updated with each new batch of samples logged by a
+    :class:`TriggerListener`, so their values are ready as soon as a response is
+    made without needing another pass over the raw samples. New statistics can
+    be added by subclassing this class and overriding :meth:`reset`,
+    :meth:`_update`, and :attr:`value`, then passing an instance to
+    :meth:`TriggerListener.add_stat`.
+
+    Args:
+        name (str): The name of the statistic in the listener's summary.
+        trigger (str): The trigger to compute the statistic for ('left' or 'right').
+
+    """
+    def __init__(self, name, trigger):
+        self.name = name
+        self._field = 'lt' if trigger == 'left' else 'rt'
+        self.reset()
+
+    def reset(self):
+        """Resets the statistic before a new response collection loop.
+
+        """
+        pass
+
+    def update(self, samples):
+        """Updates the statistic with a batch of new samples.
+
+        Args:
+            samples (:obj:`numpy.ndarray`): The new samples, in the format of
+                :attr:`TriggerBuffer.samples`.
+
+        """
+        if len(samples):
+            self._update(samples['time'], samples[self._field] / TRIGGER_MAX)
+
+    def _update(self, times, values):
+        pass
+
+    @property
+    def value(self):
+        """The current value of the statistic."""
+        return None
+
+
+class TriggerMax(TriggerStat):
+    """The maximum state of a trigger (min = 0.0, max = 1.0)."""
+
+    def reset(self):
+        self._max = 0.0
+
+    def _update(self, times, values):
+        self._max = max(self._max, float(values.max()))
+
+    @property
+    def value(self):
+        return self._max
+
+
+class TriggerLast(TriggerStat):
+    """The most recent state of a trigger (min = 0.0, max = 1.0)."""
+
+    def reset(self):
+        self._last = 0.0
+
+    def _update(self, times, values):
+        self._last = float(values[-1])
+
+    @property
+    def value(self):
+        return self._last
+
+
+class TriggerOnset(TriggerStat):
+    """The time (in ms) at which a trigger first moved past a small threshold.
+
+    The value is None if the trigger never moved past the threshold.
+
+    Args:
+        name (str): The name of the statistic in the listener's summary.
+        trigger (str): The trigger to compute the statistic for ('left' or 'right').
+        threshold (float, optional): The minimum trigger state to count as
+            movement. Defaults to 0.05.
+
+    """
+    def __init__(self, name, trigger, threshold=0.05):
+        self._threshold = threshold
+        super(TriggerOnset, self).__init__(name, trigger)
+
+    def reset(self):
+        self._onset = None
+
+    def _update(self, times, values):
+        if self._onset is None:
+            moved = values >= self._threshold
+            if moved.any():
+                self._onset = int(times[np.argmax(moved)])
 
     @property
-    def left(self):
-        """float: The state of the left trigger (min = 0.0, max = 1.0)."""
-        return self._lt / TRIGGER_MAX
+    def value(self):
+        return self._onset
+
+
+class TriggerArea(TriggerStat):
+    """The area under a trigger's pressure curve (in ms at full pressure).
+
+    Each sample's state is assumed to hold until the next sample, with the
+    trigger released at the start of the collection loop.
+
+    """
+    def reset(self):
+        self._area = 0.0
+        self._prev_time = 0
+        self._prev_value = 0.0
+
+    def _update(self, times, values):
+        t = np.concatenate(([self._prev_time], times)).astype(np.float64)
+        v = np.concatenate(([self._prev_value], values[:-1]))
+        self._area += float(np.sum(v * np.diff(t)))
+        self._prev_time = int(times[-1])
+        self._prev_value = float(values[-1])
 
     @property
-    def right(self):
-        """float: The state of the right trigger (min = 0.0, max = 1.0)."""
-        return self._rt / TRIGGER_MAX
+    def value(self):
+        return self._area
 
 
 
@@ -55,6 +270,14 @@ class TriggerListener(BaseResponseListener):
     triggers need to be in terms of pressure before a left or right response can be
     registered.
 
+    In addition to logging the raw trigger samples, the listener keeps running
+    statistics for each trigger as samples arrive (see :attr:`summary`). By
+    default these are the maximum ('left_max', 'right_max') and last
+    ('left_last', 'right_last') states of each trigger, the time of each
+    trigger's first movement ('left_onset', 'right_onset'), and the area under
+    each trigger's pressure curve ('left_auc', 'right_auc'). Other statistics
+    can be added with :meth:`add_stat`.
+
     Args:
         mapping (dict): A dictionary specifying the trigger responses to check for
             ('left', 'right', and/or 'both') and their corresponding response labels.
@@ -68,19 +291,36 @@ class TriggerListener(BaseResponseListener):
             valid response. Defaults to None (no timeout).
         loop_callback (callable, optional): An optional function or method to be
             called every time the collection loop checks for new input.
+        clock (callable, optional): A function returning the current time (in ms)
+            on the same clock as the timestamps of trigger events, used to mark
+            the start of the collection loop. Defaults to ``SDL_GetTicks``.
+        input_clock (:obj:`inputclock.InputClock`, optional): If provided, RTs
+            are measured from the arrival times of trigger events with
+            sub-millisecond resolution, relative to :attr:`onset_time` (e.g. the
+            time of the target flip) if set. Defaults to None.
     
     """
     def __init__(
-        self, mapping, gamepad=None, threshold=0.5, timeout=None, loop_callback=None
+        self, mapping, gamepad=None, threshold=0.5, timeout=None, loop_callback=None,
+        clock=None, input_clock=None
     ):
         # Fallback mapping for missing controller?
         super(TriggerListener, self).__init__(timeout, loop_callback)
+        self.clock = clock if clock else sdl2.SDL_GetTicks
+        self.input_clock = input_clock
+        self.onset_time = None
         self._map = {}
         self._pad = gamepad
         self._threshold = threshold # between 0 and 1
         self._lt_state = 0
         self._rt_state = 0
-        self._raw_data = []
+        self._buffer = TriggerBuffer()
+        self._stats = []
+        for trigger in ('left', 'right'):
+            self.add_stat(TriggerMax(trigger + '_max', trigger))
+            self.add_stat(TriggerLast(trigger + '_last', trigger))
+            self.add_stat(TriggerOnset(trigger + '_onset', trigger))
+            self.add_stat(TriggerArea(trigger + '_auc', trigger))
         # Parse and initialize the mapping of buttons/axes to responses
         for resp, label in mapping.items():
             resp_cleaned = resp.split(" ")[0].lower()
@@ -90,9 +330,9 @@ class TriggerListener(BaseResponseListener):
             self._map[resp_cleaned] = label
 
     def _timestamp(self):
-        # Since gamepad events have SDL timestamps, use SDL_GetTicks to mark the
-        # start of the collection loop.
-        return sdl2.SDL_GetTicks()
+        # Since gamepad events have SDL timestamps, use SDL_GetTicks (by default)
+        # to mark the start of the collection loop.
+        return self.clock()
 
     def init(self):
         # Initializes the listener before the response collection loop
@@ -100,8 +340,11 @@ class TriggerListener(BaseResponseListener):
         flush()
         self._lt_state = 0
         self._rt_state = 0
-        self._raw_data = []
+        self._buffer.clear()
+        for stat in self._stats:
+            stat.reset()
         self._loop_start = self._timestamp()
+        self._loop_start_time = perf_counter()
 
     def listen(self, q):
         """See :meth:`BaseResponseListener.listen`.
@@ -110,12 +353,15 @@ class TriggerListener(BaseResponseListener):
         if self._pad:
             self._pad.update()
 
-        # Gather trigger motion events per timestamp for the given controller
-        events = []
+        # Log trigger motion events for the given controller, one sample per
+        # controller update
+        start = len(self._buffer)
+        arrivals = []
+        sample_axes = set()
         for e in q:
             if e.type == sdl2.SDL_CONTROLLERAXISMOTION:
                 # If gamepad specified and event is from another controller, ignore it
-                if self._pad and e.caxis.which != self._pad.index:
+                if self._pad and e.caxis.which != self._pad.instance_id:
                     continue
                 # Process trigger motion events
                 if e.caxis.axis in TRIGGER_AXES:
@@ -124,29 +370,246 @@ class TriggerListener(BaseResponseListener):
                         self._lt_state = e.caxis.value
                     else:
                         self._rt_state = e.caxis.value
-                    # Log current state, updating last event if timestamp unchanged
-                    t = e.caxis.timestamp - self._loop_start
-                    event = TriggerData(t, self._lt_state, self._rt_state)
-                    if len(events) and events[-1].timestamp == event.timestamp:
-                        events[-1] = event
+                    # Log the current state. Events for the other trigger from the
+                    # same update (i.e. with the same timestamp and arrival time)
+                    # are merged into one sample, but a trigger moving again is
+                    # always a new sample, even within the same ms.
+                    t = max(e.caxis.timestamp - self._loop_start, 0)
+                    arrival = self.input_clock.arrival(e) if self.input_clock else None
+                    merge = (
+                        len(self._buffer) > start and e.caxis.axis not in sample_axes
+                        and (not arrivals or arrivals[-1] == arrival)
+                    )
+                    n = len(self._buffer)
+                    self._buffer.append(t, self._lt_state, self._rt_state, merge)
+                    if len(self._buffer) == n:
+                        sample_axes.add(e.caxis.axis)
                     else:
-                        events.append(event)
-        
-        # Log raw trigger motion and check for response criteria
-        mapping = list(self._map.keys())
-        single = not 'both' in mapping
-        for e in events:
-            self._raw_data.append(e)
-            lresp = e.left >= self._threshold
-            rresp = e.right >= self._threshold
-            allow_resp = single or abs(e.left - e.right) >= self._threshold
-            if 'both' in mapping and lresp and rresp:
-                return (self._map['both'], e.timestamp)
-            if 'left' in mapping and lresp and allow_resp:
-                return (self._map['left'], e.timestamp)
-            if 'right' in mapping and rresp and allow_resp:
-                return (self._map['right'], e.timestamp)
+                        sample_axes = set([e.caxis.axis])
+                    if self.input_clock:
+                        if len(self._buffer) == n:
+                            arrivals[-1] = arrival
+                        else:
+                            arrivals.append(arrival)
+
+        # Check new trigger states for response criteria
+        new = self._buffer.samples[start:]
+        if not len(new):
+            return None
+        resp, i = self._check_response(new)
+        if resp:
+            # Ignore any samples after the response
+            self._buffer.truncate(start + i + 1)
+            new = new[:(i + 1)]
+        for stat in self._stats:
+            stat.update(new)
+        if resp:
+            rt = int(new['time'][i])
+            if self.input_clock:
+                # Get the high-resolution RT relative to the onset time (if set)
+                # or the start of the collection loop
+                onset = self.onset_time if self.onset_time else self._loop_start_time
+                rt = (arrivals[i] - onset) * 1000.0
+            return (self._map[resp], rt)
+
+    def _check_response(self, new):
+        # Finds the first sample in a batch meeting the criteria for a response,
+        # returning the type and index of the response (or (None, None) if there isn't one)
+        threshold = self._threshold * TRIGGER_MAX
+        lt = new['lt'].astype(np.int32)
+        rt = new['rt'].astype(np.int32)
+        lresp = lt >= threshold
+        rresp = rt >= threshold
+        allow_resp = True
+        if 'both' in self._map:
+            allow_resp = np.abs(lt - rt) >= threshold
+        responses = {
+            'both': lresp & rresp,
+            'left': lresp & allow_resp,
+            'right': rresp & allow_resp,
+        }
+        found = np.zeros(len(new), dtype=bool)
+        for resp in self._map.keys():
+            found |= responses[resp]
+        if not found.any():
+            return (None, None)
+        i = int(np.argmax(found))
+        for resp in ('both', 'left', 'right'):
+            if resp in self._map and responses[resp][i]:
+                return (resp, i)
+
+    def add_stat(self, stat):
+        """Adds a running statistic to compute from the trigger samples.
+
+        Args:
+            stat (:obj:`TriggerStat`): The statistic to add.
+
+        """
+        if stat.name in [s.name for s in self._stats]:
+            raise ValueError("A stat named '{0}' already exists.".format(stat.name))
+        self._stats.append(stat)
+
+    @property
+    def summary(self):
+        """dict: The current values of the listener's running statistics."""
+        return {stat.name: stat.value for stat in self._stats}
 
     @property
     def raw_data(self):
-        return self._raw_data
+        """:obj:`numpy.ndarray`: The raw trigger samples from the last collection
+        loop, as a structured array with 'time', 'lt', and 'rt' fields (see
+        :class:`TriggerBuffer`).
+
+        """
+        return self._buffer.samples
+
+    @property
+    def buffer(self):
+        """:obj:`TriggerBuffer`: The buffer of raw trigger samples from the last
+        collection loop.
+
+        """
+        return self._buffer
+
+
+
+class MultiTriggerListener(BaseResponseListener):
+    """A class for collecting trigger responses from several controllers at once.
+
+    Works like :class:`TriggerListener`, except that trigger states are tracked
+    separately for each controller and every controller can make its own response
+    (e.g. for testing two participants at the same time)::
+
+       self.multi_listener = MultiTriggerListener(
+           {'Left': 'left', 'Right': 'right'}, gamepads=controllers
+       )
+       self.multi_listener.collect()
+       for instance_id, (response, rt) in self.multi_listener.responses.items():
+           ...
+
+    Each controller's trigger states are kept in a shared NumPy array, with the
+    controller's row found from the instance ID of each event with a single
+    dictionary lookup. Each event only updates and checks the state of the
+    controller it came from, so the cost of each loop depends on the number of
+    new events rather than the number of controllers.
+
+    Collection ends once every controller has responded or the timeout has been
+    reached. The response and RT of each controller are then available from
+    :attr:`responses`.
+
+    Args:
+        mapping (dict): A dictionary specifying the trigger responses to check for
+            ('left', 'right', and/or 'both') and their corresponding response labels.
+        gamepads (list): The GameController objects representing the controllers
+            to check for responses.
+        threshold (float, optional): The threshold specifying how far a trigger needs
+            to be pressed to be considered a response (0.1 = pressed 10%, 1.0 =
+            pressed 100%). Defaults to 0.5.
+        timeout (float, optional): The maximum duration (in seconds) to wait for
+            responses. Defaults to None (no timeout).
+        loop_callback (callable, optional): An optional function or method to be
+            called every time the collection loop checks for new input.
+        clock (callable, optional): A function returning the current time (in ms)
+            on the same clock as the timestamps of trigger events, used to mark
+            the start of the collection loop. Defaults to ``SDL_GetTicks``.
+
+    """
+    def __init__(
+        self, mapping, gamepads, threshold=0.5, timeout=None, loop_callback=None,
+        clock=None
+    ):
+        super(MultiTriggerListener, self).__init__(timeout, loop_callback)
+        self.clock = clock if clock else sdl2.SDL_GetTicks
+        self._map = {}
+        self._pads = list(gamepads)
+        self._ids = [pad.instance_id for pad in self._pads]
+        self._rows = {instance_id: i for i, instance_id in enumerate(self._ids)}
+        # Only USB fallback controllers need to be updated to get new input
+        self._usb_pads = [pad for pad in self._pads if getattr(pad, 'usb_pad', None)]
+        self._threshold = int(threshold * TRIGGER_MAX)
+        n = len(self._pads)
+        self._states = np.zeros((n, 2), dtype=np.int32)
+        self._labels = [None] * n
+        self._rts = np.full(n, -1, dtype=np.int64)
+        self._remaining = n
+        for resp, label in mapping.items():
+            resp_cleaned = resp.split(" ")[0].lower()
+            if not resp_cleaned in ['left', 'right', 'both']:
+                e = "'{}' is not a valid trigger response type."
+                raise ValueError(e.format(resp))
+            self._map[resp_cleaned] = label
+
+    def _timestamp(self):
+        return self.clock()
+
+    def init(self):
+        # Initializes the listener before the response collection loop
+        flush()
+        self._states[:] = 0
+        self._labels = [None] * len(self._pads)
+        self._rts[:] = -1
+        self._remaining = len(self._pads)
+        self._loop_start = self._timestamp()
+
+    def _check_response(self, lt, rt):
+        # Checks whether a controller's trigger states meet the criteria for a
+        # response, returning the type of response (or None if there isn't one)
+        lresp = lt >= self._threshold
+        rresp = rt >= self._threshold
+        if 'both' in self._map:
+            if lresp and rresp:
+                return 'both'
+            if abs(lt - rt) < self._threshold:
+                return None
+        if lresp and 'left' in self._map:
+            return 'left'
+        if rresp and 'right' in self._map:
+            return 'right'
+        return None
+
+    def listen(self, q):
+        """See :meth:`BaseResponseListener.listen`.
+
+        Returns:
+            dict: The (response label, RT) of each controller, keyed by instance
+            ID, once all controllers have responded. Otherwise None.
+
+        """
+        for pad in self._usb_pads:
+            pad.update()
+
+        rows = self._rows
+        states = self._states
+        for e in q:
+            if e.type != sdl2.SDL_CONTROLLERAXISMOTION:
+                continue
+            if e.caxis.axis not in TRIGGER_AXES:
+                continue
+            # Route the event to its controller, ignoring unknown or finished ones
+            i = rows.get(e.caxis.which)
+            if i is None or self._labels[i] is not None:
+                continue
+            states[i, e.caxis.axis - TRIGGER_LEFT] = e.caxis.value
+            resp = self._check_response(int(states[i, 0]), int(states[i, 1]))
+            if resp:
+                self._labels[i] = self._map[resp]
+                self._rts[i] = max(e.caxis.timestamp - self._loop_start, 0)
+                self._remaining -= 1
+
+        if self._remaining == 0:
+            return self.responses
+
+    @property
+    def responses(self):
+        """dict: The (response label, RT) of each controller from the last
+        collection loop, keyed by instance ID. Controllers that didn't respond
+        have a response of (None, TIMEOUT).
+
+        """
+        out = {}
+        for i, instance_id in enumerate(self._ids):
+            if self._labels[i] is None:
+                out[instance_id] = (None, TIMEOUT)
+            else:
+                out[instance_id] = (self._labels[i], int(self._rts[i]))
+        return out
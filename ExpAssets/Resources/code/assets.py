@@ -0,0 +1,80 @@
+from concurrent.futures import ThreadPoolExecutor
+
+
+class AssetLoader(object):
+    """Prepares experiment assets on a pool of background threads.
+
+    Assets are prepared as soon as they are submitted, and can then be retrieved
+    by name once they're needed. Retrieving an asset only blocks if it hasn't
+    finished loading yet::
+
+       self.assets = AssetLoader()
+       self.assets.submit('fish', NumpySurface, fish_path, width=fish_width)
+       ...
+       self.fish = self.assets.get('fish')
+
+    Any exception raised while preparing an asset is re-raised when the asset
+    is retrieved.
+
+    Since klibs' graphics and text rendering functions are not safe to call from
+    multiple threads at once, assets that share state with the main thread
+    (e.g. text rendered with a shared font) should only be prepared while the
+    main thread is not using that state.
+
+    Args:
+        workers (int, optional): The number of background threads to use for
+            preparing assets. Defaults to 2.
+
+    """
+    def __init__(self, workers=2):
+        self._pool = ThreadPoolExecutor(max_workers=workers)
+        self._futures = {}
+
+    def submit(self, name, func, *args, **kwargs):
+        """Starts preparing an asset in the background.
+
+        Args:
+            name (str): The name to use for retrieving the asset.
+            func (callable): The function to call to prepare the asset.
+            *args: Positional arguments to pass to the function.
+            **kwargs: Keyword arguments to pass to the function.
+
+        Returns:
+            :obj:`concurrent.futures.Future`: A future for the prepared asset.
+
+        """
+        if name in self._futures:
+            raise ValueError("An asset named '{0}' already exists.".format(name))
+        future = self._pool.submit(func, *args, **kwargs)
+        self._futures[name] = future
+        return future
+
+    def get(self, name):
+        """Retrieves a prepared asset, waiting for it to finish if necessary.
+
+        Args:
+            name (str): The name of the asset to retrieve.
+
+        Returns:
+            The return value of the asset's preparation function.
+
+        """
+        return self._futures[name].result()
+
+    def ready(self, name):
+        """Checks whether an asset has finished preparing.
+
+        Args:
+            name (str): The name of the asset to check.
+
+        Returns:
+            bool: True if the asset is ready, otherwise False.
+
+        """
+        return self._futures[name].done()
+
+    def shutdown(self):
+        """Waits for all assets to finish preparing and stops the background threads.
+
+        """
+        self._pool.shutdown(wait=True)
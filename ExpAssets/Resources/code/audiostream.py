@@ -0,0 +1,267 @@
+import ctypes
+import threading
+from bisect import insort
+from time import perf_counter
+
+import numpy as np
+import sdl2
+from sdl2 import sdlmixer
+
+
+class StreamChannel(object):
+    """A single audio stream being played through a :class:`StreamPlayer`.
+
+    Stream channels have the same playback interface as klibs'
+    :class:`~klibs.KLAudio.AudioClip` objects, so they can be used as drop-in
+    replacements for looping audio clips. In addition, volume changes can be
+    scheduled ahead of time with :meth:`set_volume`, in which case they are
+    applied by the audio callback at the exact output sample they were
+    scheduled for.
+
+    """
+    def __init__(self, player, stream, volume=1.0):
+        self._player = player
+        self._stream = stream
+        self._volume = volume
+        self._playing = False
+        self._schedule = []
+        self._deferred = []
+
+    def _resolve_deferred(self):
+        # Maps volume changes scheduled before the player's first callback to
+        # output samples. Called with the player's lock held.
+        for t, volume in self._deferred:
+            insort(self._schedule, (self._player._sample_at(t), volume))
+        self._deferred = []
+
+    def _gains(self, start, frames):
+        # Gets the volume(s) for the next chunk of output, applying any scheduled
+        # volume changes that fall within it. Called with the player's lock held.
+        if not self._schedule or self._schedule[0][0] >= start + frames:
+            return self._volume
+        gains = np.full((frames, 1), self._volume, dtype=np.float32)
+        while self._schedule and self._schedule[0][0] < start + frames:
+            sample, volume = self._schedule.pop(0)
+            gains[max(sample - start, 0):] = volume
+            self._volume = volume
+        return gains
+
+    def play(self, loop=True):
+        """Starts playback of the stream.
+
+        Args:
+            loop (bool, optional): Ignored, since streams never end. Only present
+                for compatibility with :class:`~klibs.KLAudio.AudioClip`.
+
+        """
+        self._playing = True
+        self._player.start()
+
+    def stop(self):
+        """Stops playback of the stream.
+
+        """
+        self._playing = False
+
+    def set_volume(self, volume, at=None):
+        """Schedules a change in the volume of the stream.
+
+        Args:
+            volume (float): The new volume of the stream, from 0.0 (muted) to
+                1.0 (max).
+            at (float, optional): The time (in seconds, on the
+                :func:`time.perf_counter` clock) at which the change should be
+                heard. Defaults to None (as soon as possible).
+
+        If the player hasn't output any audio yet, the change is mapped to an
+        output sample once the first audio callback has run.
+
+        """
+        volume = min(max(float(volume), 0.0), 1.0)
+        if at is None:
+            at = perf_counter()
+        with self._player._lock:
+            sample = self._player._sample_at(at)
+            if sample is None:
+                # Output timing isn't known until the first callback, so map the
+                # change to an output sample then
+                self._deferred.append((at, volume))
+            else:
+                insort(self._schedule, (sample, volume))
+
+    def cancel(self):
+        """Cancels any scheduled volume changes for the stream.
+
+        """
+        with self._player._lock:
+            self._schedule = []
+            self._deferred = []
+
+    @property
+    def playing(self):
+        """bool: Whether the stream is currently playing."""
+        return self._playing
+
+    @property
+    def volume(self):
+        """float: The volume of the stream, from 0.0 (muted) to 1.0 (max).
+
+        Setting the volume directly cancels any scheduled volume changes.
+
+        """
+        return self._volume
+
+    @volume.setter
+    def volume(self, value):
+        with self._player._lock:
+            self._schedule = []
+            self._deferred = []
+            self._volume = min(max(float(value), 0.0), 1.0)
+
+
+
+class LoopStream(object):
+    """An audio stream that endlessly loops a pre-generated audio clip.
+
+    Args:
+        clip (:obj:`numpy.ndarray`): A (samples, 2) int16 array containing the
+            left/right channel samples of the clip.
+
+    """
+    def __init__(self, clip):
+        self._clip = clip
+        self._pos = 0
+
+    def read(self, frames):
+        """Reads the next chunk of audio from the stream.
+
+        """
+        idx = (self._pos + np.arange(frames)) % len(self._clip)
+        self._pos = (self._pos + frames) % len(self._clip)
+        return self._clip[idx].astype(np.float32) / 32767
+
+
+
+class StreamPlayer(object):
+    """Mixes and plays one or more audio streams through the SDL_mixer music hook.
+
+    Streams are read in small chunks directly from SDL_mixer's audio callback
+    and summed into a single output stream, so they play without ever being
+    synthesized in full or looped. A stream can be any object with a
+    ``read(frames)`` method that returns a (frames, 2) float32 array of samples
+    between -1.0 and 1.0 (e.g. a :class:`noise.PinkNoiseStream`).
+
+    Since all streams are mixed into the same output, volume changes scheduled
+    ahead of time for different streams (see :meth:`StreamChannel.set_volume`)
+    happen on the same output sample. Scheduled times are mapped to output
+    samples using the time of the most recent audio callback, so the timing of
+    scheduled changes is only affected by jitter in the audio callback (at most
+    one audio buffer), not by the timing of the experiment's render loop. The
+    mapping assumes that each buffer of audio is heard one buffer after it is
+    requested by the callback.
+
+    Since SDL_mixer only supports a single music hook, only one StreamPlayer
+    can be active at a time. The audio device must be opened (e.g. by klibs)
+    before the player is created.
+
+    """
+    def __init__(self):
+        freq, fmt, chans = ctypes.c_int(0), sdl2.Uint16(0), ctypes.c_int(0)
+        if sdlmixer.Mix_QuerySpec(ctypes.byref(freq), ctypes.byref(fmt), ctypes.byref(chans)) == 0:
+            raise RuntimeError("The audio device must be opened before streaming audio.")
+        if fmt.value not in (sdl2.AUDIO_S16SYS, sdl2.AUDIO_F32SYS) or chans.value != 2:
+            e = "Unsupported audio device format ({0} channels, format {1})."
+            raise RuntimeError(e.format(chans.value, fmt.value))
+        self.sample_rate = freq.value
+        self._float_output = fmt.value == sdl2.AUDIO_F32SYS
+        self._sample_bytes = 4 if self._float_output else 2
+        self._channels = []
+        self._hook = sdlmixer.mix_func(self._mix)
+        self._started = False
+        self._lock = threading.Lock()
+        self._frame = 0 # index of the next output sample to be mixed
+        self._callback_time = None
+        self._buffer_frames = 0
+
+    def _mix(self, udata, stream, length):
+        # Audio callback: sums all playing streams into the output buffer
+        frames = length // (self._sample_bytes * 2)
+        mixed = np.zeros((frames, 2), dtype=np.float32)
+        with self._lock:
+            self._callback_time = perf_counter()
+            self._buffer_frames = frames
+            start = self._frame
+            self._frame += frames
+            for channel in self._channels:
+                if channel._deferred:
+                    channel._resolve_deferred()
+            gains = [channel._gains(start, frames) for channel in self._channels]
+        for channel, gain in zip(self._channels, gains):
+            if channel.playing:
+                mixed += channel._stream.read(frames) * gain
+        np.clip(mixed, -1.0, 1.0, out=mixed)
+        if self._float_output:
+            out = mixed
+        else:
+            out = (mixed * 32767).astype(np.int16)
+        ctypes.memmove(stream, out.ctypes.data, length)
+
+    def sample_at(self, t=None):
+        """Estimates the index of the output sample that will be heard at a given time.
+
+        Args:
+            t (float, optional): A time (in seconds) on the :func:`time.perf_counter`
+                clock. Defaults to None (the current time).
+
+        Returns:
+            int: The index of the output sample that will be heard at the given
+            time, or None if the player hasn't output any audio yet.
+
+        """
+        if t is None:
+            t = perf_counter()
+        with self._lock:
+            return self._sample_at(t)
+
+    def _sample_at(self, t):
+        # Maps a time to an output sample. Called with the lock held.
+        if self._callback_time is None:
+            return None
+        elapsed = t - self._callback_time
+        latest = self._frame - self._buffer_frames
+        # The most recently mixed buffer is heard one buffer after it was mixed
+        return latest - self._buffer_frames + int(round(elapsed * self.sample_rate))
+
+    def add(self, stream, volume=1.0):
+        """Adds an audio stream to the player.
+
+        Args:
+            stream: The audio stream to add.
+            volume (float, optional): The initial volume of the stream. Defaults
+                to 1.0 (max volume).
+
+        Returns:
+            :obj:`StreamChannel`: An object for controlling the stream's playback.
+
+        """
+        channel = StreamChannel(self, stream, volume)
+        self._channels.append(channel)
+        return channel
+
+    def start(self):
+        """Starts streaming audio to the output device, if not already started.
+
+        """
+        if not self._started:
+            sdlmixer.Mix_HookMusic(self._hook, None)
+            self._started = True
+
+    def close(self):
+        """Stops all streams and removes the player from the audio device.
+
+        """
+        if self._started:
+            sdlmixer.Mix_HookMusic(sdlmixer.mix_func(), None)
+            self._started = False
+        for channel in self._channels:
+            channel.stop()
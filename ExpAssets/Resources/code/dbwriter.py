@@ -0,0 +1,221 @@
+import atexit
+import sqlite3
+import threading
+from queue import Queue
+from itertools import chain, groupby
+
+
+def _run_key(item):
+    # Gets the table and columns of a pending row, or None if other rows are
+    # linked to it (and so it needs its own insert to get its ID)
+    table, row, linked = item
+    return None if linked else (table, tuple(row.keys()))
+
+
+
+class TrialWriter(object):
+    """Buffers rows for the experiment database in memory and writes them in batches.
+
+    Writing each trial's data to the database as soon as the trial ends means
+    waiting on the disk between trials. A trial writer instead keeps new rows in
+    memory until :meth:`flush` is called (e.g. at a break), then writes them all
+    in a single transaction on a background thread (using its own connection
+    to the database)::
+
+       self.trial_writer = TrialWriter(P.database_path, tables=('trials',))
+       self.trial_writer.wrap(self.db)
+       ...
+       self.trial_writer.flush()
+
+    Rows can also be linked to the next row added to another table with
+    :meth:`attach`, in which case they are written with that row's ID (e.g. to
+    key per-trial data by the ID of its trial in the 'trials' table). Attached
+    rows that are never followed by a row in their parent table (e.g. if the
+    session is quit mid-trial) are written unlinked when the writer is closed.
+
+    Any rows still waiting to be written are written when the writer is closed,
+    which happens automatically when Python exits (e.g. after quitting or a
+    crash). If writing a batch fails, its rows are kept and retried on the next
+    flush.
+
+    Args:
+        path (str): The path of the database file.
+        tables (tuple, optional): The tables to buffer rows for when wrapping a
+            database (see :meth:`wrap`). Defaults to ('trials',).
+        max_pending (int, optional): If set, the number of pending rows at which
+            they are flushed automatically. Defaults to None (only flush when
+            requested).
+
+    """
+    def __init__(self, path, tables=('trials',), max_pending=None):
+        self.path = path
+        self._tables = set(tables)
+        self._max_pending = max_pending
+        self._pending = []
+        self._attached = {}
+        self._lock = threading.Lock()
+        self._queue = Queue()
+        self._writer = threading.Thread(target=self._write_loop, daemon=True)
+        self._writer.start()
+        self.error = None
+        atexit.register(self.close)
+
+    def _write_loop(self):
+        # Writes batches of rows to the database in the background
+        db = sqlite3.connect(self.path, timeout=30)
+        try:
+            while True:
+                item = self._queue.get()
+                if item is None:
+                    break
+                batch, done = item
+                try:
+                    self._write(db, batch)
+                    self.error = None
+                except sqlite3.Error as e:
+                    # Put the rows back so they're retried on the next flush
+                    with self._lock:
+                        self._pending[:0] = batch
+                    self.error = e
+                if done:
+                    done.set()
+        finally:
+            db.close()
+
+    def _insert_sql(self, table, cols):
+        return "INSERT INTO {0} ({1}) VALUES ({2})".format(
+            table,
+            ", ".join('"{0}"'.format(col) for col in cols),
+            ", ".join(["?"] * len(cols)),
+        )
+
+    def _insert_row(self, db, table, row):
+        # Inserts a single row, returning its ID
+        cols = tuple(row.keys())
+        return db.execute(self._insert_sql(table, cols), [row[c] for c in cols]).lastrowid
+
+    def _write(self, db, batch):
+        # Inserts a batch of rows (and any rows linked to them) in a single
+        # transaction. Rows are inserted table by table (in order within each
+        # table), with runs of unlinked rows with the same columns inserted
+        # together in a single executemany.
+        tables = {}
+        for item in batch:
+            tables.setdefault(item[0], []).append(item)
+        runs = [groupby(items, key=_run_key) for items in tables.values()]
+        with db:
+            for run_key, run in chain.from_iterable(runs):
+                if run_key is not None:
+                    table, cols = run_key
+                    values = [[row[c] for c in cols] for _, row, _ in run]
+                    db.executemany(self._insert_sql(table, cols), values)
+                    continue
+                for table, row, linked in run:
+                    row_id = self._insert_row(db, table, row)
+                    for linked_table, linked_row, key in linked:
+                        linked_row = dict(linked_row)
+                        linked_row[key] = row_id
+                        self._insert_row(db, linked_table, linked_row)
+
+    def insert(self, data, table='trials'):
+        """Adds a row to be written to the database on the next flush.
+
+        Args:
+            data (dict): The row to add, with column names as keys.
+            table (str, optional): The table to add the row to. Defaults to
+                'trials'.
+
+        """
+        with self._lock:
+            linked = self._attached.pop(table, [])
+            self._pending.append((table, dict(data), linked))
+            full = self._max_pending and len(self._pending) >= self._max_pending
+        if full:
+            self.flush(wait=False)
+
+    def attach(self, data, table, parent='trials', key='trial_id'):
+        """Adds a row to be written along with the next row added to another table.
+
+        Args:
+            data (dict): The row to add, with column names as keys.
+            table (str): The table to add the row to.
+            parent (str, optional): The table of the row to link the new row to.
+                Defaults to 'trials'.
+            key (str, optional): The column in which to store the ID of the
+                linked row. Defaults to 'trial_id'.
+
+        """
+        with self._lock:
+            self._attached.setdefault(parent, []).append((table, dict(data), key))
+
+    def wrap(self, db, default_table='trials'):
+        """Routes a database's inserts for the buffered tables through the writer.
+
+        Inserts into other tables (or of anything other than a dict of column
+        values) are passed through to the database as usual. Since buffered rows
+        aren't given IDs until they're written, buffered inserts return None
+        instead of the new row's ID: use :meth:`attach` to link other rows to them.
+
+        Args:
+            db: The database object to wrap (e.g. ``self.db``).
+            default_table (str, optional): The table inserts go to when no
+                table is given, as in klibs' ``db.insert``. Defaults to 'trials'.
+
+        """
+        db_insert = db.insert
+        def buffered_insert(data, *args, **kwargs):
+            table = kwargs.get('table', args[0] if len(args) else default_table)
+            if table in self._tables and isinstance(data, dict):
+                self.insert(data, table)
+                return None
+            return db_insert(data, *args, **kwargs)
+        db.insert = buffered_insert
+
+    def flush(self, wait=False):
+        """Writes all pending rows to the database in a single transaction.
+
+        Args:
+            wait (bool, optional): Whether to wait for the rows to be written
+                before returning. Defaults to False.
+
+        """
+        with self._lock:
+            batch = self._pending
+            self._pending = []
+        if not (batch or wait):
+            return
+        done = threading.Event() if wait else None
+        self._queue.put((batch, done))
+        if wait:
+            done.wait()
+
+    def close(self):
+        """Writes all pending rows to the database and stops the writer thread.
+
+        Any attached rows still waiting for a row in their parent table are
+        written without a link (i.e. with their key column left NULL).
+
+        Raises:
+            RuntimeError: If any rows could not be written to the database.
+
+        """
+        if self._writer is None:
+            return
+        atexit.unregister(self.close)
+        with self._lock:
+            for attached in self._attached.values():
+                for table, row, key in attached:
+                    self._pending.append((table, row, []))
+            self._attached = {}
+        self.flush(wait=True)
+        self._queue.put(None)
+        self._writer.join()
+        self._writer = None
+        if self._pending:
+            e = "Unable to write {0} rows to the database ({1})."
+            raise RuntimeError(e.format(len(self._pending), self.error))
+
+    @property
+    def pending(self):
+        """int: The number of rows waiting to be written to the database."""
+        return len(self._pending)
@@ -0,0 +1,287 @@
+import os
+import json
+import threading
+from collections import deque
+from queue import Queue, Empty
+
+import sdl2
+
+from gamepad import get_controllers
+from gamepad_usb import PYUSB_AVAILABLE, Virtual360Controller
+if PYUSB_AVAILABLE:
+    import py360
+
+DRIVER_SDL = 'sdl'
+DRIVER_USB = 'usb'
+
+DEFAULT_REGISTRY_PATH = os.path.normpath(
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "devices.json")
+)
+
+
+def _usb_id(vendor, product):
+    # Gets the vendor/product ID string for a device (as used by py360.VALID_IDS)
+    return '{0}:{1}'.format(vendor, product)
+
+
+def _sdl_controllers():
+    # Gets all SDL game controllers, excluding virtual ones (i.e. USB fallbacks)
+    return [p for p in get_controllers() if not sdl2.SDL_JoystickIsVirtual(p.index)]
+
+
+
+class DeviceRegistry(object):
+    """A record of the controllers found on this system and how they were found.
+
+    Each controller model (identified by its USB vendor/product IDs) is stored
+    along with the driver it was found with: either SDL ('sdl') or the direct
+    USB fallback ('usb'). The registry is saved to disk, so it keeps a record of
+    every controller model used on the system and how it was found::
+
+       self.devices = DeviceRegistry()
+       controllers = self.devices.find_controllers()
+
+    Args:
+        path (str, optional): The path of the registry file. Defaults to
+            'devices.json' in the ExpAssets/Resources folder.
+
+    """
+    def __init__(self, path=DEFAULT_REGISTRY_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._drivers = {}
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, 'r') as f:
+                    self._drivers = dict(json.load(f))
+            except (IOError, ValueError):
+                # If the registry can't be read, start a new one
+                self._drivers = {}
+
+    def driver(self, vendor, product):
+        """Gets the driver a controller model was last found with.
+
+        Args:
+            vendor (int): The USB vendor ID of the controller.
+            product (int): The USB product ID of the controller.
+
+        Returns:
+            str: The driver ('sdl' or 'usb'), or None if the model is unknown.
+
+        """
+        return self._drivers.get(_usb_id(vendor, product))
+
+    def remember(self, vendor, product, driver):
+        """Records the driver a controller model was found with.
+
+        Args:
+            vendor (int): The USB vendor ID of the controller.
+            product (int): The USB product ID of the controller.
+            driver (str): The driver the controller was found with ('sdl' or 'usb').
+
+        """
+        usb_id = _usb_id(vendor, product)
+        with self._lock:
+            if self._drivers.get(usb_id) == driver:
+                return
+            self._drivers[usb_id] = driver
+            tmp_path = self.path + '.tmp'
+            with open(tmp_path, 'w') as f:
+                json.dump(self._drivers, f, indent=2, sort_keys=True)
+            os.replace(tmp_path, self.path)
+
+    def remember_usb(self, usb_device):
+        """Records that a controller was found with the direct USB fallback.
+
+        Args:
+            usb_device: The PyUSB device object for the controller.
+
+        """
+        self.remember(usb_device.idVendor, usb_device.idProduct, DRIVER_USB)
+
+    def find_controllers(self):
+        """Gets the controllers connected to the system.
+
+        SDL controllers are checked for first. If there aren't any, the USB bus is
+        scanned for controllers SDL doesn't support, so that a controller plugged
+        in at launch is always used from the start of the session.
+
+        Returns:
+            list: The connected controllers.
+
+        """
+        connected = _sdl_controllers()
+        for pad in connected:
+            info = pad._info
+            self.remember(info['vendor_id'], info['product_id'], DRIVER_SDL)
+        if PYUSB_AVAILABLE and not len(connected):
+            connected_usb = py360.get_controllers()
+            if len(connected_usb):
+                self.remember_usb(connected_usb[0])
+                connected.append(Virtual360Controller(connected_usb[0]))
+        return connected
+
+
+
+class HotplugMonitor(object):
+    """Keeps track of controllers being connected or disconnected during a session.
+
+    Controllers connected or disconnected through SDL are noticed from SDL's
+    device added/removed events. Since USB fallback controllers aren't visible
+    to SDL until opened, a background thread periodically scans the USB bus for
+    them while no controller is in use (so the scan never blocks the main loop),
+    and a fallback controller is considered disconnected once its USB reads fail.
+
+    Controllers are only opened or closed when :meth:`poll` is called, so that
+    the current controller can be swapped at a safe point (e.g. between blocks,
+    so that the response device never changes partway through a block)::
+
+       self.hotplug = HotplugMonitor(self.devices)
+       self.hotplug.start(self.gamepad)
+       ...
+       if self.hotplug.poll():
+           self.gamepad = self.hotplug.gamepad
+
+    USB fallback controllers are presented to SDL as virtual joysticks, which
+    the monitor removes from SDL when it is stopped.
+
+    Args:
+        registry (:obj:`DeviceRegistry`): The registry to record newly-found
+            controllers in.
+        interval (float, optional): The time (in seconds) between USB scans.
+            Defaults to 2.0.
+
+    """
+    def __init__(self, registry, interval=2.0):
+        self._registry = registry
+        self._interval = interval
+        self._added = deque()
+        self._removed = deque()
+        self._found_usb = Queue()
+        self._want_usb = threading.Event()
+        self._stopping = threading.Event()
+        self._scanner = None
+        self._watch = sdl2.SDL_EventFilter(self._on_event)
+        self._virtual = []
+        self.gamepad = None
+
+    def _on_event(self, userdata, event):
+        # SDL event watch callback: notes controllers being added or removed
+        e = event.contents
+        if e.type == sdl2.SDL_CONTROLLERDEVICEADDED:
+            self._added.append(e.cdevice.which)
+        elif e.type == sdl2.SDL_CONTROLLERDEVICEREMOVED:
+            self._removed.append(e.cdevice.which)
+        return 0
+
+    def _scan_loop(self):
+        # Scans the USB bus for fallback controllers while no controller is in use
+        while not self._stopping.wait(self._interval):
+            if not self._want_usb.is_set():
+                continue
+            try:
+                devices = py360.get_controllers()
+            except IOError:
+                continue
+            if len(devices):
+                self._want_usb.clear()
+                self._registry.remember_usb(devices[0])
+                self._found_usb.put(devices[0])
+
+    def start(self, gamepad=None):
+        """Starts monitoring for controllers being connected or disconnected.
+
+        Args:
+            gamepad (optional): The controller currently in use, if any.
+
+        """
+        self.gamepad = gamepad
+        if getattr(gamepad, 'usb_pad', None):
+            self._virtual.append(gamepad)
+        sdl2.SDL_AddEventWatch(self._watch, None)
+        if PYUSB_AVAILABLE:
+            self._scanner = threading.Thread(target=self._scan_loop, daemon=True)
+            self._scanner.start()
+        self._update_scan()
+
+    def stop(self):
+        """Stops monitoring for controllers being connected or disconnected.
+
+        Any USB fallback controllers managed by the monitor (including one passed
+        to :meth:`start`) are closed, and their virtual joysticks removed from SDL.
+
+        """
+        sdl2.SDL_DelEventWatch(self._watch, None)
+        if self._scanner:
+            self._stopping.set()
+            self._scanner.join()
+            self._scanner = None
+        if self.gamepad in self._virtual:
+            self.gamepad = None
+        for pad in self._virtual:
+            self._close(pad)
+        self._virtual = []
+
+    def _update_scan(self):
+        # Only scan USB when no controller is in use
+        if self.gamepad is None:
+            self._want_usb.set()
+        else:
+            self._want_usb.clear()
+
+    def _close(self, pad):
+        # Closes a disconnected controller, ignoring errors from the missing device
+        try:
+            pad.close()
+        except IOError:
+            pass
+
+    def poll(self):
+        """Updates the current controller for any connected or disconnected devices.
+
+        If the current controller has been disconnected, it is closed. If no
+        controller is in use and a new one has been connected, it is opened and
+        becomes the current controller (see :attr:`gamepad`).
+
+        Returns:
+            bool: True if the current controller has changed, otherwise False.
+
+        """
+        pad = self.gamepad
+        removed = set()
+        while self._removed:
+            removed.add(self._removed.popleft())
+        if pad is not None:
+            usb_pad = getattr(pad, 'usb_pad', None)
+            if pad.instance_id in removed or (usb_pad and usb_pad.read_error):
+                self._close(pad)
+                if pad in self._virtual:
+                    self._virtual.remove(pad)
+                pad = None
+
+        added = len(self._added) > 0
+        self._added.clear()
+        if pad is None and added:
+            connected = _sdl_controllers()
+            if len(connected):
+                pad = connected[0]
+                pad.initialize()
+                info = pad._info
+                self._registry.remember(info['vendor_id'], info['product_id'], DRIVER_SDL)
+        if pad is None:
+            try:
+                pad = Virtual360Controller(self._found_usb.get_nowait())
+                self._virtual.append(pad)
+                pad.initialize()
+            except Empty:
+                pass
+            except IOError:
+                # If the controller was unplugged again before opening, keep looking
+                self._close(pad)
+                self._virtual.remove(pad)
+                pad = None
+
+        changed = pad is not self.gamepad
+        self.gamepad = pad
+        self._update_scan()
+        return changed
@@ -0,0 +1,473 @@
+from time import perf_counter
+
+import numpy as np
+from klibs.KLGraphics import fill as _fill
+from klibs.KLGraphics import blit as _blit
+from klibs.KLGraphics import flip as _flip
+
+_flip_count = 0
+_flip_log = None
+_backend = None
+
+
+def use_backend(backend):
+    """Replaces klibs' drawing functions with those of a different display backend.
+
+    Once set, :func:`fill`, :func:`blit`, and :func:`flip` call the backend's
+    methods of the same names instead of klibs' (e.g. to run the experiment with
+    a :class:`headless.HeadlessDisplay`).
+
+    Args:
+        backend: The backend to use, or None to use klibs' drawing functions.
+
+    """
+    global _backend
+    _backend = backend
+
+
+def fill(*args, **kwargs):
+    """Fills the screen buffer with a colour.
+
+    Wraps :func:`klibs.KLGraphics.fill`, and takes the same arguments.
+
+    """
+    if _backend is not None:
+        _backend.fill(*args, **kwargs)
+    else:
+        _fill(*args, **kwargs)
+
+
+def blit(*args, **kwargs):
+    """Draws a stimulus to the screen buffer.
+
+    Wraps :func:`klibs.KLGraphics.blit`, and takes the same arguments.
+
+    """
+    if _backend is not None:
+        _backend.blit(*args, **kwargs)
+    else:
+        _blit(*args, **kwargs)
+
+
+def flip():
+    """Flips the screen buffer, keeping count of the total number of flips.
+
+    Wraps :func:`klibs.KLGraphics.flip`, and should be used in its place so that
+    :class:`FrameDisplay` objects know when something else has been drawn to the
+    screen and so that flips can be timed by a :class:`FlipLog`.
+
+    """
+    global _flip_count
+    if _backend is not None:
+        _backend.flip()
+    else:
+        _flip()
+    t = perf_counter()
+    _flip_count += 1
+    if _flip_log is not None:
+        _flip_log._record(t)
+
+
+def flip_count():
+    """Gets the total number of times the screen has been flipped with :func:`flip`.
+
+    Returns:
+        int: The number of flips so far.
+
+    """
+    return _flip_count
+
+
+
+class FrameDisplay(object):
+    """Presents cached frames, skipping redundant work when they haven't changed.
+
+    Loops that show the same display on every refresh (e.g. the fixation period)
+    only need to draw it once: every subsequent frame is drawn from a single
+    cached texture (see :class:`framecache.FrameCache`) rather than re-blitting
+    each stimulus::
+
+       while self.evm.before('warning_on'):
+           self.check_anticipatory()
+           self.display.show([(self.fixation, P.screen_c)])
+
+    Optionally, once an unchanged frame has been drawn to every buffer in the
+    swap chain, the display can skip drawing entirely and just flip, reusing the
+    contents of the previous back buffer. Since OpenGL does not guarantee that
+    back buffers are preserved after a flip, this is only safe on systems where
+    the swap chain is known to be preserved and its length is known, and is
+    disabled by default. When enabled, the number of buffers must be at least
+    the depth of the swap chain (2 for double-buffering): with fewer, a skipped
+    frame can flip a back buffer that still holds an older frame.
+
+    Either way, :meth:`show` always flips the screen, so loop timing remains
+    locked to the display's refresh rate.
+
+    Args:
+        cache (:obj:`framecache.FrameCache`): The cache to draw frames from.
+        reuse_buffers (int, optional): If greater than 0, unchanged frames that
+            have already been drawn to this many back buffers in a row are not
+            redrawn. Must be at least the depth of the swap chain if set.
+            Defaults to 0 (always redraw).
+
+    """
+    def __init__(self, cache, reuse_buffers=0):
+        self._cache = cache
+        self._reuse = reuse_buffers
+        self._key = None
+        self._drawn = 0
+        self._last_flip = -1
+
+    def show(self, layers):
+        """Draws a frame to the screen (if needed) and flips the screen buffer.
+
+        Args:
+            layers (list): A list of (stimulus, location[, registration]) tuples
+                making up the frame. See :func:`framecache.compose` for more info.
+
+        """
+        key = self._cache.add(layers)
+        # If anything else was flipped since the last show, the frame has changed
+        unchanged = key == self._key and self._last_flip == flip_count()
+        if not (unchanged and self._reuse and self._drawn >= self._reuse):
+            fill()
+            self._cache.draw(key)
+            self._drawn = self._drawn + 1 if unchanged else 1
+        self._key = key
+        flip()
+        self._last_flip = flip_count()
+
+    def invalidate(self):
+        """Forces the next frame to be redrawn.
+
+        """
+        self._key = None
+
+
+
+class FlipLog(object):
+    """Records the time of every screen flip, e.g. over the course of a trial.
+
+    While recording, the time at which every :func:`flip` returns is logged.
+    Flips that carry stimulus onsets can be labelled by calling :meth:`mark`
+    just before they happen, after which their timing can be compared to the
+    intended onset times::
+
+       self.flip_log.start()
+       ...
+       self.flip_log.mark('target_on')
+       self.display.show(target_layers)
+       self.flip_log.stop()
+
+    Only one FlipLog can record at a time.
+
+    """
+    def __init__(self):
+        self._times = []
+        self._labels = {}
+        self._pending = []
+        self._start = None
+
+    def _record(self, t):
+        for label in self._pending:
+            self._labels[label] = len(self._times)
+        self._pending = []
+        self._times.append(t)
+
+    def start(self, t=None):
+        """Clears the log and starts recording flip times.
+
+        Args:
+            t (float, optional): The time (on the :func:`time.perf_counter` clock)
+                to treat as the start of the log. Defaults to the current time.
+
+        """
+        global _flip_log
+        self._times = []
+        self._labels = {}
+        self._pending = []
+        self._start = perf_counter() if t is None else t
+        _flip_log = self
+
+    def stop(self):
+        """Stops recording flip times.
+
+        """
+        global _flip_log
+        if _flip_log is self:
+            _flip_log = None
+
+    def mark(self, label):
+        """Labels the next flip as the onset of a given stimulus or event.
+
+        Args:
+            label (str): The label for the next flip.
+
+        """
+        self._pending.append(label)
+
+    def onset(self, label):
+        """Gets the time of a labelled flip, relative to the start of the log.
+
+        Args:
+            label (str): The label of the flip.
+
+        Returns:
+            float: The time of the flip (in ms), or None if no flip with the given
+            label was recorded.
+
+        """
+        if label not in self._labels:
+            return None
+        return (self._times[self._labels[label]] - self._start) * 1000.0
+
+    def flip_time(self, label):
+        """Gets the absolute time of a labelled flip.
+
+        Args:
+            label (str): The label of the flip.
+
+        Returns:
+            float: The time of the flip (in seconds, on the :func:`time.perf_counter`
+            clock), or None if no flip with the given label was recorded.
+
+        """
+        if label not in self._labels:
+            return None
+        return self._times[self._labels[label]]
+
+    @property
+    def times(self):
+        """:obj:`numpy.ndarray`: The times of all recorded flips (in ms), relative
+        to the start of the log.
+
+        """
+        return (np.asarray(self._times) - self._start) * 1000.0
+
+    def summary(self, scheduled):
+        """Summarizes the timing of the recorded flips.
+
+        The refresh interval of the display is estimated as the median interval
+        between flips, and any interval longer than 1.5 refreshes is counted as
+        one or more dropped frames.
+
+        Args:
+            scheduled (dict): A dictionary of flip labels and their intended onset
+                times (in ms, relative to the start of the log).
+
+        Returns:
+            dict: A dictionary containing the scheduled and actual onset times of
+            each labelled flip (as '<label>_sched' and '<label>_actual'), the
+            estimated refresh interval ('refresh_ms'), the number of flips
+            ('flips'), the number of dropped frames ('dropped_frames'), and the
+            standard deviation of the intervals between flips ('flip_jitter').
+            Onset times and intervals are in ms, and are None if not recorded.
+
+        """
+        intervals = np.diff(self.times)
+        refresh, jitter, dropped = (None, None, 0)
+        if len(intervals):
+            refresh = float(np.median(intervals))
+            jitter = float(np.std(intervals))
+            dropped = int(np.sum(np.maximum(np.round(intervals / refresh) - 1, 0)))
+        out = {}
+        for label, onset in scheduled.items():
+            out[label + "_sched"] = onset
+            out[label + "_actual"] = self.onset(label)
+        out['refresh_ms'] = refresh
+        out['flips'] = len(self._times)
+        out['dropped_frames'] = dropped
+        out['flip_jitter'] = jitter
+        return out
+
+
+def measure_refresh(flips=60):
+    """Estimates the refresh interval of the display by timing repeated flips.
+
+    The screen is filled with the default fill colour and flipped the given
+    number of times, so this should only be called when nothing else needs to
+    be shown (e.g. during setup).
+
+    Args:
+        flips (int, optional): The number of flips to time. Defaults to 60.
+
+    Returns:
+        float: The median interval between flips (in ms).
+
+    """
+    times = []
+    for i in range(flips + 1):
+        fill()
+        flip()
+        times.append(perf_counter())
+    return float(np.median(np.diff(times))) * 1000.0
+
+
+
+class FrameSchedule(object):
+    """Schedules stimulus onsets to the screen refresh closest to their intended times.
+
+    Events are added the same way as with klibs' EventManager, but instead of
+    an event starting on whichever refresh happens to come after its deadline
+    (up to a full refresh late), each event is presented on the refresh whose
+    predicted time is closest to it. Refresh times are predicted from the time
+    of the last flip and the refresh interval of the display. Events scheduled
+    relative to another event are timed from the actual onset of that event, so
+    the delivered interval between them is always a whole number of refreshes::
+
+       self.schedule = FrameSchedule(self.flip_log, self.refresh_ms)
+       self.schedule.add_event('cue_on', 1000)
+       self.schedule.add_event('target_on', 200, after='cue_on')
+       ...
+       self.flip_log.start()
+       while self.schedule.before('target_on'):
+           self.display.show(cue_layers)
+       self.display.show(target_layers)
+
+    The schedule uses a :class:`FlipLog` to keep track of flip times, labelling
+    the flip for each event with the event's name. As such, the log must be
+    recording while the schedule is in use, and each event's onset is the time
+    of the first flip after :meth:`before` first returns False for it.
+
+    Args:
+        log (:obj:`FlipLog`): The flip log to use for timing flips.
+        refresh (float): The refresh interval of the display (in ms).
+
+    """
+    def __init__(self, log, refresh):
+        self._log = log
+        self.refresh = refresh
+        self._events = {}
+        self._due = set()
+
+    def add_event(self, label, onset, after=None):
+        """Adds an event to the schedule.
+
+        Args:
+            label (str): The name of the event.
+            onset (float): The intended onset of the event (in ms), relative to
+                the start of the flip log or to the onset of another event.
+            after (str, optional): The name of the event to schedule the onset
+                relative to. Defaults to None (relative to the start of the log).
+
+        """
+        if after and after not in self._events:
+            raise ValueError("No event named '{0}' in the schedule.".format(after))
+        self._events[label] = (onset, after)
+
+    def frames(self, label):
+        """Gets the number of refreshes an event is scheduled after its parent event.
+
+        Args:
+            label (str): The name of the event.
+
+        Returns:
+            int: The number of refreshes between the events.
+
+        """
+        return int(round(self._events[label][0] / self.refresh))
+
+    def target(self, label):
+        """Gets the time of the refresh on which an event should be presented.
+
+        Args:
+            label (str): The name of the event.
+
+        Returns:
+            float: The intended onset time of the event (in ms, relative to the
+            start of the flip log), or None if the event is relative to an event
+            that hasn't been presented yet.
+
+        """
+        onset, after = self._events[label]
+        if after is None:
+            return onset
+        parent = self._log.onset(after)
+        if parent is None:
+            return None
+        return parent + self.frames(label) * self.refresh
+
+    def next_flip(self):
+        """Predicts the time of the next screen refresh.
+
+        Returns:
+            float: The predicted time of the next refresh (in ms, relative to the
+            start of the flip log).
+
+        """
+        now = (perf_counter() - self._log._start) * 1000.0
+        if not self._log._times:
+            return now + self.refresh
+        last = (self._log._times[-1] - self._log._start) * 1000.0
+        missed = max(np.floor((now - last) / self.refresh), 0)
+        return last + (missed + 1) * self.refresh
+
+    def predict(self, label):
+        """Predicts the time of the flip on which an event will be presented.
+
+        This is useful for timing things that aren't drawn (e.g. sounds) to the
+        actual onset of an event, rather than to its intended onset.
+
+        Args:
+            label (str): The name of the event.
+
+        Returns:
+            float: The predicted onset of the event (as a :func:`perf_counter`
+            time), or None if it can't be predicted yet (i.e. if nothing has
+            been flipped since the log was started, or the event is relative to
+            an event that hasn't been presented yet).
+
+        """
+        onset = self._log.onset(label)
+        if onset is None:
+            target = self.target(label)
+            if target is None or not self._log._times:
+                return None
+            now = (perf_counter() - self._log._start) * 1000.0
+            last = (self._log._times[-1] - self._log._start) * 1000.0
+            missed = max(np.floor((now - last) / self.refresh), 0)
+            # The event is presented on the first refresh within half a refresh
+            # of its target, or the next refresh if that has already passed
+            k = max(np.ceil((target - self.refresh / 2.0 - last) / self.refresh), missed + 1)
+            onset = last + k * self.refresh
+        return self._log._start + onset / 1000.0
+
+    def before(self, label):
+        """Checks whether an event should not be presented on the next flip yet.
+
+        Once this returns False for an event, the next flip is labelled with the
+        event's name in the flip log.
+
+        Args:
+            label (str): The name of the event.
+
+        Returns:
+            bool: True if a later refresh is closer to the event's intended onset
+            than the next one, otherwise False.
+
+        """
+        if label in self._due:
+            return False
+        target = self.target(label)
+        if target is None or self.next_flip() < target - self.refresh / 2.0:
+            return True
+        self._due.add(label)
+        self._log.mark(label)
+        return False
+
+    def delivered(self, label, since):
+        """Gets the delivered interval between the onsets of two events.
+
+        Args:
+            label (str): The name of the later event.
+            since (str): The name of the earlier event.
+
+        Returns:
+            float: The time between the onsets of the two events (in ms), or None
+            if either event wasn't presented.
+
+        """
+        end, start = (self._log.onset(label), self._log.onset(since))
+        if end is None or start is None:
+            return None
+        return end - start
@@ -0,0 +1,204 @@
+from collections import OrderedDict
+
+import numpy as np
+from OpenGL.GL import (
+    glGenTextures, glDeleteTextures, glBindTexture, glTexParameteri, glTexImage2D,
+    glEnable, glDisable, glBegin, glEnd, glTexCoord2f, glVertex2f,
+    GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, GL_TEXTURE_MIN_FILTER, GL_NEAREST,
+    GL_RGBA, GL_UNSIGNED_BYTE, GL_QUADS,
+)
+
+
+def _pixels(stim):
+    # Gets the rendered RGBA pixels for a NumpySurface or Drawbject
+    content = stim.render()
+    if hasattr(content, 'render'):
+        content = content.render()
+    return np.asarray(content, dtype=np.uint8)
+
+
+def _registered(loc, registration, w, h):
+    # Gets the top-left corner of a surface blitted with a given registration,
+    # where registrations are laid out like a number pad (7 = top-left, 5 = center)
+    col = (registration - 1) % 3
+    row = 2 - (registration - 1) // 3
+    return (int(loc[0] - col * w / 2.0), int(loc[1] - row * h / 2.0))
+
+
+def compose(layers, bg_color):
+    """Composes a set of stimuli into a single opaque RGBA image.
+
+    Layers are drawn in order over a solid background, with the same positioning
+    as blitting them with :func:`~klibs.KLGraphics.blit`. The resulting image only
+    covers the bounding box of the layers.
+
+    Args:
+        layers (list): A list of (stimulus, location) or (stimulus, location,
+            registration) tuples, where each stimulus is a :obj:`NumpySurface` or
+            :obj:`Drawbject`. If no registration is given, layers are centered on
+            their locations (i.e. a registration of 5).
+        bg_color (tuple): The RGB(A) colour of the background.
+
+    Returns:
+        tuple: The composed (height, width, 4) uint8 image, and the (x, y) screen
+        coordinates of its top-left corner.
+
+    """
+    rects = []
+    for layer in layers:
+        stim, loc = layer[:2]
+        registration = layer[2] if len(layer) > 2 else 5
+        px = _pixels(stim)
+        h, w = px.shape[:2]
+        rects.append((px,) + _registered(loc, registration, w, h))
+    x0 = min(x for px, x, y in rects)
+    y0 = min(y for px, x, y in rects)
+    x1 = max(x + px.shape[1] for px, x, y in rects)
+    y1 = max(y + px.shape[0] for px, x, y in rects)
+
+    out = np.empty((y1 - y0, x1 - x0, 4), dtype=np.float32)
+    out[:] = list(bg_color)[:3] + [255]
+    for px, x, y in rects:
+        h, w = px.shape[:2]
+        region = out[(y - y0):(y - y0 + h), (x - x0):(x - x0 + w), :3]
+        src = px.astype(np.float32)
+        alpha = src[:, :, 3:4] / 255.0
+        region[:] = src[:, :, :3] * alpha + region * (1.0 - alpha)
+    return (np.round(out).astype(np.uint8), (x0, y0))
+
+
+
+class FrameCache(object):
+    """A cache of pre-composed trial displays, stored as OpenGL textures.
+
+    Each unique combination of stimuli and locations is composed into a single
+    image and uploaded to the graphics card the first time it is added, after
+    which drawing it only requires a single textured quad (unlike klibs'
+    :func:`~klibs.KLGraphics.blit`, which uploads a new texture on every call)::
+
+       key = self.frames.add([(self.fixation, P.screen_c), (self.fish, loc)])
+       ...
+       fill()
+       self.frames.draw(key)
+       flip()
+
+    Since adding frames uploads textures, frames must be added from the main
+    thread after the display has been initialized. Once the cache is full, the
+    least-recently used frames are removed to make room for new ones.
+
+    Args:
+        bg_color (tuple): The RGB(A) colour of the background to compose frames
+            over (usually ``P.default_fill_color``).
+        max_frames (int, optional): The maximum number of frames to cache.
+            Defaults to 128.
+        backend (optional): A display backend (e.g. a
+            :class:`headless.HeadlessDisplay`) to upload, draw, and delete
+            textures with instead of OpenGL. Defaults to None (use OpenGL).
+
+    """
+    def __init__(self, bg_color, max_frames=128, backend=None):
+        self._bg_color = bg_color
+        self._max_frames = max_frames
+        self._frames = OrderedDict()
+        self._backend = backend
+
+    def _upload(self, pixels):
+        if self._backend is not None:
+            return self._backend.upload(pixels)
+        tex = glGenTextures(1)
+        glBindTexture(GL_TEXTURE_2D, tex)
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, GL_NEAREST)
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_NEAREST)
+        h, w = pixels.shape[:2]
+        glTexImage2D(
+            GL_TEXTURE_2D, 0, GL_RGBA, w, h, 0, GL_RGBA, GL_UNSIGNED_BYTE, pixels
+        )
+        return tex
+
+    def _delete(self, tex):
+        if self._backend is not None:
+            self._backend.delete(tex)
+        else:
+            glDeleteTextures([tex])
+
+    def key(self, layers):
+        """Gets the cache key for a given set of layers.
+
+        Args:
+            layers (list): A list of (stimulus, location[, registration]) tuples.
+
+        Returns:
+            tuple: The cache key for the frame.
+
+        """
+        key = []
+        for layer in layers:
+            loc = layer[1]
+            registration = layer[2] if len(layer) > 2 else 5
+            key.append((id(layer[0]), int(loc[0]), int(loc[1]), registration))
+        return tuple(key)
+
+    def add(self, layers):
+        """Composes and caches a frame, if not already cached.
+
+        Args:
+            layers (list): A list of (stimulus, location[, registration]) tuples
+                to compose into a frame. See :func:`compose` for more info.
+
+        Returns:
+            tuple: The cache key for the frame.
+
+        """
+        key = self.key(layers)
+        if key in self._frames:
+            self._frames.move_to_end(key)
+        else:
+            while len(self._frames) >= self._max_frames:
+                tex, rect, stims = self._frames.popitem(last=False)[1]
+                self._delete(tex)
+            pixels, (x, y) = compose(layers, self._bg_color)
+            h, w = pixels.shape[:2]
+            # NOTE: Keeping references to the stimuli ensures their ids (and thus
+            # the cache key) can't be reused by new objects while cached
+            stims = [layer[0] for layer in layers]
+            self._frames[key] = (self._upload(pixels), (x, y, x + w, y + h), stims)
+        return key
+
+    def draw(self, key):
+        """Draws a cached frame to the screen buffer.
+
+        Args:
+            key (tuple): The cache key of the frame to draw.
+
+        """
+        tex, (x0, y0, x1, y1), stims = self._frames[key]
+        if self._backend is not None:
+            self._backend.draw(tex, (x0, y0, x1, y1))
+            return
+        glEnable(GL_TEXTURE_2D)
+        glBindTexture(GL_TEXTURE_2D, tex)
+        glBegin(GL_QUADS)
+        glTexCoord2f(0, 0)
+        glVertex2f(x0, y0)
+        glTexCoord2f(1, 0)
+        glVertex2f(x1, y0)
+        glTexCoord2f(1, 1)
+        glVertex2f(x1, y1)
+        glTexCoord2f(0, 1)
+        glVertex2f(x0, y1)
+        glEnd()
+        glDisable(GL_TEXTURE_2D)
+
+    def clear(self):
+        """Removes all frames from the cache, freeing their textures.
+
+        """
+        for tex, rect, stims in self._frames.values():
+            self._delete(tex)
+        self._frames = OrderedDict()
+
+    def __len__(self):
+        return len(self._frames)
+
+    def __contains__(self, key):
+        return key in self._frames
@@ -334,6 +334,23 @@ class GameController(object):
     def index(self):
         return self._index
 
+    @property
+    def instance_id(self):
+        # The SDL instance ID of the controller (used by its events), if open
+        if not self._stick:
+            return None
+        return jy.SDL_JoystickInstanceID(self._stick)
+
+
+_button_ids = {}
+
+def _button_id(name):
+    # Looks up the SDL button ID for a button name, caching the result
+    if name not in _button_ids:
+        button_bytes = utf8(name).encode('utf-8')
+        _button_ids[name] = gc.SDL_GameControllerGetButtonFromString(button_bytes)
+    return _button_ids[name]
+
 
 def button_pressed(events, button=None, device=None, on_release=False):
     c_event = SDL_CONTROLLERBUTTONDOWN
@@ -344,8 +361,7 @@ def button_pressed(events, button=None, device=None, on_release=False):
     if button:
         if _is_text(button):
             # TODO: Validation of button strings?
-            button_bytes = utf8(button).encode('utf-8')
-            button = gc.SDL_GameControllerGetButtonFromString(button_bytes)
+            button = _button_id(button)
         button = int(button)
         # NOTE: Extra buttons added in SDL 2.0.14, should err if requesting newer button
         # with older lib
@@ -355,13 +371,15 @@ def button_pressed(events, button=None, device=None, on_release=False):
 
     pressed = False
     for e in events:
-        if device != None and e.which != device.instance_id:
-            continue
         if e.type == c_event:
+            if device != None and e.cbutton.which != device.instance_id:
+                continue
             if button == None or e.cbutton.button == button:
                 pressed = True
                 break
         elif e.type == j_event:
+            if device != None and e.jbutton.which != device.instance_id:
+                continue
             if button == None or e.jbutton.button == button:
                 pressed = True
                 break
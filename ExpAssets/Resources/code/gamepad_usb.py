@@ -1,3 +1,4 @@
+import numpy as np
 import sdl2
 import sdl2.ext
 
@@ -39,6 +40,19 @@ AXIS_MAP = {
     AXIS_RIGHTY: sdl2.SDL_CONTROLLER_AXIS_RIGHTY,
 }
 
+AXIS_FIELDS = {
+    AXIS_LT: 'lt',
+    AXIS_RT: 'rt',
+    AXIS_LEFTX: 'lx',
+    AXIS_LEFTY: 'ly',
+    AXIS_RIGHTX: 'rx',
+    AXIS_RIGHTY: 'ry',
+}
+
+COALESCE_POLICIES = ('triggers', 'latest', 'all')
+
+STICK_AXES = [AXIS_LEFTX, AXIS_LEFTY, AXIS_RIGHTX, AXIS_RIGHTY]
+
 
 def get_all_controllers():
     # Try getting SDL2 controllers, fall back to PyUSB if available
@@ -52,16 +66,61 @@ def get_all_controllers():
 
 
 
-class Virtual360Controller(GameController):
+def _sdl_axis_values(packets):
+    # Converts the raw axis values of an array of USB packets to the ranges used
+    # by SDL, returning an array with a column for each axis
+    values = np.empty((len(packets), len(ALL_AXES)), dtype=np.int32)
+    for axis in ALL_AXES:
+        values[:, axis] = packets[AXIS_FIELDS[axis]]
+    values[:, [AXIS_LEFTY, AXIS_RIGHTY]] *= -1
+    values[:, [AXIS_LEFTY, AXIS_RIGHTY]] -= 1
+    values[:, [AXIS_LT, AXIS_RT]] *= 257
+    values[:, [AXIS_LT, AXIS_RT]] -= 32768
+    return values
+
 
-    def __init__(self, usb_device):
+
+class Virtual360Controller(GameController):
+    """An Xbox 360 controller read over USB and presented to SDL as a virtual joystick.
+
+    On each :meth:`update`, new input from the controller is injected into SDL,
+    which then generates the usual controller events. Only axes whose values have
+    changed are updated. If several packets have arrived since the last update,
+    the coalescing policy determines whether every changed trigger value is
+    injected but only the latest stick values ('triggers'), only the latest
+    values of all axes are ('latest'), or every changed value is ('all'). Since
+    trigger responses (and their stored traces) are measured from every trigger
+    sample SDL sees, 'latest' should only be used when the triggers aren't
+    being used for responses. Button presses and releases are always injected
+    in full. Each packet's button and axis changes are pushed to SDL together,
+    in the order the packets arrived.
+
+    Args:
+        usb_device: The PyUSB device object for the controller.
+        coalesce (str, optional): The policy for injecting axis values when
+            several packets arrive between updates ('triggers', 'latest', or
+            'all'). Defaults to 'triggers'.
+
+    If the controller's ``input_clock`` attribute is set to an
+    :class:`inputclock.InputClock`, the events SDL creates for injected input are
+    stamped with the times the input was received over USB.
+
+    """
+    def __init__(self, usb_device, coalesce='triggers'):
+        if coalesce not in COALESCE_POLICIES:
+            e = "'{0}' is not a valid coalescing policy."
+            raise ValueError(e.format(coalesce))
         self._pad = None
         self._stick = None
         self._index = self._init_virtual()
+        self._virtual_id = sdl2.SDL_JoystickGetDeviceInstanceID(self._index)
         self._info = _get_joystick_info(self._index)
 
         self._usb_dev = usb_device
+        self._coalesce = coalesce
+        self._axis_values = None
         self.usb_pad = None
+        self.input_clock = None
 
     def _init_virtual(self):
         n_axes = 6
@@ -77,26 +136,73 @@ class Virtual360Controller(GameController):
         GameController.initialize(self)
 
     def close(self):
-        self.usb_pad.disconnect()
+        """Disconnects from the USB controller and removes its virtual joystick.
+
+        """
+        if self.usb_pad:
+            self.usb_pad.disconnect()
+            self.usb_pad = None
         GameController.close(self)
+        self.detach()
+
+    def detach(self):
+        """Removes the controller's virtual joystick from SDL.
+
+        """
+        if self._virtual_id is None:
+            return
+        # Device indices shift as devices come and go, so look it up by ID
+        for i in range(sdl2.SDL_NumJoysticks()):
+            if sdl2.SDL_JoystickGetDeviceInstanceID(i) == self._virtual_id:
+                sdl2.SDL_JoystickDetachVirtual(i)
+                break
+        self._virtual_id = None
+
+    def _push(self, t):
+        # Pushes the state of the virtual controller to SDL, noting when the input
+        # was received if using an input clock
+        if self.input_clock:
+            self.input_clock.set_source_time(t)
+        sdl2.SDL_JoystickUpdate()
+        if self.input_clock:
+            self.input_clock.set_source_time(None)
 
     def update(self):
         self.usb_pad.update()
-
-        events = self.usb_pad.get_button_events()
-        for e in events:
-            b = BUTTON_MAP[e.name]
-            sdl2.SDL_JoystickSetVirtualButton(self._stick, b, e.state)
-            sdl2.SDL_JoystickUpdate()
-
-        data = self.usb_pad.get_data()
-        for d in data:
-            for axis in ALL_AXES:
+        times, data = self.usb_pad.get_data(timestamps=True)
+        button_events = self.usb_pad.get_button_events(timestamps=True)
+        values = _sdl_axis_values(data)
+
+        # Work out which axis values to inject for each packet: axes that are only
+        # injected for the latest packet are held at their previous values before it
+        if len(values):
+            # NOTE: On the first update, all axes are set
+            last = values[0] ^ 1 if self._axis_values is None else self._axis_values
+            held = {'latest': ALL_AXES, 'triggers': STICK_AXES, 'all': []}[self._coalesce]
+            if len(held):
+                values[:-1, held] = last[held]
+            previous = np.vstack([last, values[:-1]])
+            changed = values != previous
+            self._axis_values = values[-1]
+
+        # Inject each packet's button and axis changes together, in the order the
+        # packets arrived, pushing them to SDL with the packet's arrival time
+        b = 0
+        for i, t in enumerate(times):
+            pending = False
+            while b < len(button_events) and button_events[b][0] <= t:
+                e = button_events[b][1]
+                sdl2.SDL_JoystickSetVirtualButton(self._stick, BUTTON_MAP[e.name], e.state)
+                b += 1
+                pending = True
+            for axis in np.nonzero(changed[i])[0]:
                 a = AXIS_MAP[axis]
-                value = d[axis + 1]
-                if axis in [AXIS_LEFTY, AXIS_RIGHTY]:
-                    value = -(value + 1)
-                if axis in [AXIS_LT, AXIS_RT]:
-                    value = int(value * 257) - 32768
-                sdl2.SDL_JoystickSetVirtualAxis(self._stick, a, value)
-            sdl2.SDL_JoystickUpdate()
+                sdl2.SDL_JoystickSetVirtualAxis(self._stick, a, int(values[i, axis]))
+                pending = True
+            if pending:
+                self._push(t)
+
+        # Inject any button events left over without a matching packet
+        for t, e in button_events[b:]:
+            sdl2.SDL_JoystickSetVirtualButton(self._stick, BUTTON_MAP[e.name], e.state)
+            self._push(t)
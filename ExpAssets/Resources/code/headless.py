@@ -0,0 +1,103 @@
+import time
+from time import perf_counter
+
+import numpy as np
+
+
+class HeadlessDisplay(object):
+    """A display backend that counts drawing operations instead of rendering them.
+
+    When passed to :func:`display.use_backend` (and to :class:`framecache.FrameCache`),
+    nothing is drawn to the screen: instead, the number of fills, blits, and frame
+    draws are counted and the CPU time spent preparing each frame is recorded.
+    Flips wait for the next refresh of a simulated display, so loops timed by
+    flips run at the same rate as they would on a real monitor::
+
+       self.headless = HeadlessDisplay(refresh_rate=60)
+       use_backend(self.headless)
+       ...
+       print(self.headless.report())
+
+    Note that klibs still creates a window on launch, so on systems without a
+    display (e.g. CI servers) the experiment should be run with SDL's offscreen
+    video driver (i.e. with the environment variable ``SDL_VIDEODRIVER=offscreen``).
+    An audio device is still required (use ``SDL_AUDIODRIVER=dummy`` on systems
+    without one). Since only drawing is replaced, input for an unattended run
+    has to be provided separately (e.g. with a :class:`replay.ReplayFeeder`).
+
+    Args:
+        refresh_rate (float, optional): The refresh rate (in Hz) of the simulated
+            display. Defaults to 60.
+
+    """
+    def __init__(self, refresh_rate=60.0):
+        self.refresh = 1.0 / refresh_rate
+        self._textures = {}
+        self._next_tex = 1
+        self._start = perf_counter()
+        self._last_flip = self._start
+        self._frame = {'fills': 0, 'blits': 0, 'draws': 0}
+        self._frames = []
+        self.uploads = 0
+
+    def fill(self, color=None):
+        self._frame['fills'] += 1
+
+    def blit(self, source, registration=7, location=(0, 0), flip_x=False):
+        self._frame['blits'] += 1
+
+    def flip(self):
+        # Record the time spent on the frame, then wait for the next simulated
+        # refresh after the flip was requested
+        now = perf_counter()
+        self._frames.append((
+            now - self._last_flip, self._frame['fills'], self._frame['blits'],
+            self._frame['draws']
+        ))
+        self._frame = {'fills': 0, 'blits': 0, 'draws': 0}
+        refreshes = np.floor((now - self._start) / self.refresh) + 1
+        vsync = self._start + refreshes * self.refresh
+        time.sleep(max(vsync - perf_counter(), 0))
+        self._last_flip = perf_counter()
+
+    def upload(self, pixels):
+        tex = self._next_tex
+        self._textures[tex] = pixels.shape
+        self._next_tex += 1
+        self.uploads += 1
+        return tex
+
+    def draw(self, tex, rect):
+        if tex not in self._textures:
+            raise ValueError("Texture {0} does not exist.".format(tex))
+        self._frame['draws'] += 1
+
+    def delete(self, tex):
+        del self._textures[tex]
+
+    def report(self):
+        """Summarizes the cost of the frames drawn so far.
+
+        Returns:
+            dict: The number of frames flipped ('frames'), the mean, 95th percentile,
+            and maximum time spent preparing each frame in ms ('frame_ms_mean',
+            'frame_ms_95', 'frame_ms_max'), the number of frames that took longer
+            than a refresh to prepare ('slow_frames'), the mean number of fills,
+            blits, and texture draws per frame ('fills_per_frame',
+            'blits_per_frame', 'draws_per_frame'), and the number of textures
+            uploaded ('uploads').
+
+        """
+        out = {'frames': len(self._frames), 'uploads': self.uploads}
+        if not self._frames:
+            return out
+        frames = np.asarray(self._frames, dtype=np.float64)
+        frame_ms = frames[:, 0] * 1000.0
+        out['frame_ms_mean'] = float(np.mean(frame_ms))
+        out['frame_ms_95'] = float(np.percentile(frame_ms, 95))
+        out['frame_ms_max'] = float(np.max(frame_ms))
+        out['slow_frames'] = int(np.sum(frame_ms > self.refresh * 1000.0))
+        out['fills_per_frame'] = float(np.mean(frames[:, 1]))
+        out['blits_per_frame'] = float(np.mean(frames[:, 2]))
+        out['draws_per_frame'] = float(np.mean(frames[:, 3]))
+        return out
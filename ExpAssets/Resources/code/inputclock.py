@@ -0,0 +1,142 @@
+from collections import OrderedDict
+from time import perf_counter
+
+import sdl2
+
+CONTROLLER_EVENTS = set([
+    sdl2.SDL_CONTROLLERAXISMOTION, sdl2.SDL_CONTROLLERBUTTONDOWN,
+    sdl2.SDL_CONTROLLERBUTTONUP, sdl2.SDL_JOYAXISMOTION,
+    sdl2.SDL_JOYBUTTONDOWN, sdl2.SDL_JOYBUTTONUP,
+])
+
+
+def _event_key(e):
+    # Gets a key identifying a controller event, based on its contents
+    if e.type == sdl2.SDL_CONTROLLERAXISMOTION:
+        return (e.type, e.caxis.timestamp, e.caxis.which, e.caxis.axis, e.caxis.value)
+    elif e.type in (sdl2.SDL_CONTROLLERBUTTONDOWN, sdl2.SDL_CONTROLLERBUTTONUP):
+        return (e.type, e.cbutton.timestamp, e.cbutton.which, e.cbutton.button)
+    elif e.type == sdl2.SDL_JOYAXISMOTION:
+        return (e.type, e.jaxis.timestamp, e.jaxis.which, e.jaxis.axis, e.jaxis.value)
+    return (e.type, e.jbutton.timestamp, e.jbutton.which, e.jbutton.button)
+
+
+
+class InputClock(object):
+    """Stamps controller events with high-resolution arrival times.
+
+    SDL only timestamps events to the nearest millisecond. While running, an
+    input clock watches for controller events as SDL adds them to its event
+    queue and notes the time each one arrived on the :func:`time.perf_counter`
+    clock (the same clock used for timing screen flips), which can then be
+    looked up with :meth:`arrival`::
+
+       self.input_clock = InputClock()
+       self.input_clock.start()
+       ...
+       for e in pump():
+           t = self.input_clock.arrival(e)
+
+    For virtual controllers, where events are only created when input is
+    injected into SDL, the time the input was originally received can be set
+    with :meth:`set_source_time` before injecting it. Events that arrived while
+    the clock wasn't watching are mapped onto the same clock using their SDL
+    timestamps (see :meth:`sdl_to_time`).
+
+    Args:
+        max_events (int, optional): The maximum number of recent events to keep
+            arrival times for. Defaults to 4096.
+
+    """
+    def __init__(self, max_events=4096):
+        self._max_events = max_events
+        self._times = OrderedDict()
+        self._source_time = None
+        self._watch = sdl2.SDL_EventFilter(self._on_event)
+        self._running = False
+        self._offset = None
+
+    def _on_event(self, userdata, event):
+        # SDL event watch callback: notes the arrival time of controller events
+        e = event.contents
+        if e.type in CONTROLLER_EVENTS:
+            t = self._source_time if self._source_time is not None else perf_counter()
+            self._times[_event_key(e)] = t
+            if len(self._times) > self._max_events:
+                self._times.popitem(last=False)
+        return 0
+
+    def start(self):
+        """Starts noting the arrival times of controller events.
+
+        """
+        if not self._running:
+            self.sync()
+            sdl2.SDL_AddEventWatch(self._watch, None)
+            self._running = True
+
+    def sync(self):
+        """Estimates the offset between SDL's millisecond clock and the input clock.
+
+        """
+        # Since SDL's ticks are truncated to the millisecond, the smallest offset
+        # seen while the tick changes over is the most accurate
+        offsets = []
+        ticks = sdl2.SDL_GetTicks()
+        while len(offsets) < 3:
+            t = perf_counter()
+            new_ticks = sdl2.SDL_GetTicks()
+            if new_ticks != ticks:
+                offsets.append(t - new_ticks / 1000.0)
+                ticks = new_ticks
+        self._offset = min(offsets)
+
+    def sdl_to_time(self, ticks):
+        """Converts an SDL timestamp to a time on the input clock.
+
+        Args:
+            ticks (int): The SDL timestamp (in ms).
+
+        Returns:
+            float: The corresponding time on the :func:`time.perf_counter` clock.
+
+        """
+        if self._offset is None:
+            self.sync()
+        return ticks / 1000.0 + self._offset
+
+    def stop(self):
+        """Stops noting the arrival times of controller events.
+
+        """
+        if self._running:
+            sdl2.SDL_DelEventWatch(self._watch, None)
+            self._running = False
+
+    def set_source_time(self, t):
+        """Sets the arrival time to use for events added to the queue from now on.
+
+        Args:
+            t (float): The time (on the :func:`time.perf_counter` clock) at which
+                the input for the upcoming events was received, or None to use
+                the time at which the events are added.
+
+        """
+        self._source_time = t
+
+    def arrival(self, event):
+        """Gets the arrival time of a controller event.
+
+        Args:
+            event (:obj:`sdl2.SDL_Event`): The event to get the arrival time of.
+
+        Returns:
+            float: The time (on the :func:`time.perf_counter` clock) at which the
+            event arrived. If the event's arrival wasn't noted, its SDL timestamp
+            is converted to the same clock instead.
+
+        """
+        key = _event_key(event)
+        if key in self._times:
+            return self._times[key]
+        return self.sdl_to_time(key[1])
@@ -0,0 +1,244 @@
+from time import perf_counter
+
+import sdl2
+
+TRIGGER_MAX = 32767
+TRIGGER_AXES = (
+    sdl2.SDL_CONTROLLER_AXIS_TRIGGERLEFT,
+    sdl2.SDL_CONTROLLER_AXIS_TRIGGERRIGHT,
+)
+UI_MODIFIERS = sdl2.KMOD_CTRL | sdl2.KMOD_GUI
+
+# How long to wait for USB packets between checks for SDL input (in seconds)
+USB_WAIT_SLICE = 0.005
+
+
+def wait_for_event(timeout=0.1, gamepad=None):
+    """Sleeps until new input arrives, for use in loops waiting on the participant.
+
+    Unlike calling ``pump()`` in a tight loop, waiting uses almost no CPU: the
+    process sleeps until SDL has a new event in its queue (via
+    ``SDL_WaitEventTimeout``). If the given controller is a USB fallback
+    controller (whose input only reaches SDL on each update), the controller's
+    USB reader is waited on instead, with SDL's queue checked in between::
+
+       while not done:
+           wait_for_event(gamepad=self.gamepad)
+           if self.gamepad:
+               self.gamepad.update()
+           q = pump()
+           ...
+
+    Queued events are left in the queue to be fetched with ``pump()``.
+
+    Args:
+        timeout (float, optional): The maximum time (in seconds) to wait for
+            input. Defaults to 0.1.
+        gamepad (optional): The controller in use, if any.
+
+    Returns:
+        bool: True if new input has arrived, or False if the wait timed out.
+
+    """
+    usb_pad = getattr(gamepad, 'usb_pad', None)
+    if usb_pad is None or usb_pad.read_error:
+        return sdl2.SDL_WaitEventTimeout(None, int(timeout * 1000)) == 1
+    end = perf_counter() + timeout
+    while True:
+        if sdl2.SDL_PollEvent(None) == 1:
+            return True
+        remaining = end - perf_counter()
+        if remaining <= 0:
+            return False
+        if usb_pad.wait(min(remaining, USB_WAIT_SLICE)):
+            return True
+
+
+
+class ClassifiedEvents(object):
+    """The events from a single pump of the event queue, sorted by type.
+
+    Attributes:
+        ui (list): Events that may be UI requests (i.e. quit events and key
+            presses with Ctrl/Command held), for passing to ``ui_request``.
+        keys (list): Key press events.
+        buttons (list): Controller button press events.
+        triggers (list): Trigger motion events past the classifier's threshold.
+
+    """
+    __slots__ = ('ui', 'keys', 'buttons', 'triggers')
+
+    def __init__(self):
+        self.ui = []
+        self.keys = []
+        self.buttons = []
+        self.triggers = []
+
+    @property
+    def responses(self):
+        """bool: Whether any keys, buttons, or triggers were pressed."""
+        return bool(self.keys or self.buttons or self.triggers)
+
+
+
+class EventClassifier(object):
+    """Sorts the events in a queue into types of input in a single pass.
+
+    Checking a queue separately for key presses, button presses, trigger
+    presses, and UI requests means scanning the whole queue once for each. A
+    classifier instead looks up each event's type in a precomputed table and
+    sorts it into the matching category, so each event is only looked at once::
+
+       self.classifier = EventClassifier(trigger_threshold=0.1)
+       ...
+       events = self.classifier.classify(pump())
+       if events.ui:
+           ui_request(queue=events.ui)
+       if events.responses:
+           ...
+
+    Args:
+        trigger_threshold (float, optional): How far a trigger needs to be pressed
+            (from 0.0 to 1.0) for its motion to count as a trigger press.
+            Defaults to 0.1.
+
+    """
+    def __init__(self, trigger_threshold=0.1):
+        self._trigger_min = trigger_threshold * TRIGGER_MAX
+        self._handlers = {
+            sdl2.SDL_QUIT: self._ui,
+            sdl2.SDL_KEYDOWN: self._key,
+            sdl2.SDL_CONTROLLERBUTTONDOWN: self._button,
+            sdl2.SDL_CONTROLLERAXISMOTION: self._axis,
+        }
+        # NOTE: Raw joystick events are left unhandled (and so skipped), since
+        # every press is also reported by a game controller event
+
+    def _ui(self, e, out):
+        out.ui.append(e)
+
+    def _key(self, e, out):
+        out.keys.append(e)
+        if e.key.keysym.mod & UI_MODIFIERS:
+            out.ui.append(e)
+
+    def _button(self, e, out):
+        out.buttons.append(e)
+
+    def _axis(self, e, out):
+        if e.caxis.axis in TRIGGER_AXES and e.caxis.value > self._trigger_min:
+            out.triggers.append(e)
+
+    def classify(self, queue):
+        """Sorts a queue of events by type.
+
+        Args:
+            queue (list): A list of :obj:`sdl2.SDL_Event` objects (e.g. from
+                ``pump()``).
+
+        Returns:
+            :obj:`ClassifiedEvents`: The sorted events.
+
+        """
+        out = ClassifiedEvents()
+        handlers = self._handlers
+        for e in queue:
+            handler = handlers.get(e.type)
+            if handler:
+                handler(e, out)
+        return out
+
+
+# Event types the experiment never uses
+UNUSED_EVENTS = (
+    sdl2.SDL_MOUSEMOTION, sdl2.SDL_MOUSEWHEEL, sdl2.SDL_WINDOWEVENT,
+    sdl2.SDL_FINGERMOTION, sdl2.SDL_FINGERDOWN, sdl2.SDL_FINGERUP,
+    sdl2.SDL_MULTIGESTURE,
+)
+
+# Game controller axes the experiment never uses
+UNUSED_AXES = (
+    sdl2.SDL_CONTROLLER_AXIS_LEFTX, sdl2.SDL_CONTROLLER_AXIS_LEFTY,
+    sdl2.SDL_CONTROLLER_AXIS_RIGHTX, sdl2.SDL_CONTROLLER_AXIS_RIGHTY,
+)
+
+
+
+class InputProfile(object):
+    """Stops unwanted types of input events from being added to SDL's event queue.
+
+    Event types that aren't needed are disabled with ``SDL_EventState``, so SDL
+    discards them before they are ever queued (or copied into Python by
+    ``pump()``). Controller axis motion is filtered per-axis by an SDL event
+    filter, so that only the axes that are needed (e.g. the triggers) are queued::
+
+       self.input_profile = InputProfile()
+       self.input_profile.apply()
+       ...
+       print(self.input_profile.filtered)
+
+    Events dropped by the event filter are counted by type. Since events disabled
+    with ``SDL_EventState`` never reach the filter, they can only be counted by
+    setting ``count_all`` to True, in which case all unwanted events are dropped
+    by the filter instead.
+
+    Note that device added/removed events are never dropped, since SDL needs
+    them to detect controllers being connected or disconnected. Raw joystick
+    events (e.g. ``SDL_JOYAXISMOTION``) can't be dropped either: SDL generates
+    game controller events from them after they pass the event filter, so
+    dropping them would drop all controller input too. Instead, they are
+    skipped by :class:`EventClassifier`.
+
+    Args:
+        drop_types (tuple, optional): The SDL event types to drop. Defaults to
+            ``UNUSED_EVENTS``.
+        drop_axes (tuple, optional): The game controller axes to drop motion
+            events for. Defaults to ``UNUSED_AXES``.
+        count_all (bool, optional): Whether to drop (and count) all unwanted
+            events with the event filter. Defaults to False.
+
+    """
+    def __init__(self, drop_types=UNUSED_EVENTS, drop_axes=UNUSED_AXES, count_all=False):
+        self._drop_types = set(drop_types)
+        self._drop_axes = set(drop_axes)
+        self._count_all = count_all
+        self._filter = sdl2.SDL_EventFilter(self._on_event)
+        self._applied = False
+        self.counts = {}
+
+    def _on_event(self, userdata, event):
+        # SDL event filter callback: returns 0 to drop an event, 1 to keep it
+        e = event.contents
+        drop = e.type in self._drop_types
+        if e.type == sdl2.SDL_CONTROLLERAXISMOTION:
+            drop = e.caxis.axis in self._drop_axes
+        if drop:
+            self.counts[e.type] = self.counts.get(e.type, 0) + 1
+            return 0
+        return 1
+
+    def apply(self):
+        """Starts dropping unwanted events.
+
+        """
+        if not self._count_all:
+            for event_type in self._drop_types:
+                sdl2.SDL_EventState(event_type, sdl2.SDL_IGNORE)
+        sdl2.SDL_SetEventFilter(self._filter, None)
+        self._applied = True
+
+    def remove(self):
+        """Stops dropping unwanted events.
+
+        """
+        if not self._applied:
+            return
+        for event_type in self._drop_types:
+            sdl2.SDL_EventState(event_type, sdl2.SDL_ENABLE)
+        sdl2.SDL_SetEventFilter(sdl2.SDL_EventFilter(), None)
+        self._applied = False
+
+    @property
+    def filtered(self):
+        """int: The total number of events dropped by the event filter."""
+        return sum(self.counts.values())
@@ -0,0 +1,242 @@
+import os
+import csv
+import atexit
+import ctypes
+import threading
+from queue import Queue
+from time import perf_counter
+
+import numpy as np
+import sdl2
+
+SOURCE_USB = 0
+SOURCE_SDL = 1
+
+RECORD_DATA_BYTES = ctypes.sizeof(sdl2.SDL_Event)
+RECORD_DTYPE = np.dtype({
+    'names': ['time', 'source', 'size', 'data'],
+    'formats': ['<f8', 'u1', 'u1', (np.uint8, RECORD_DATA_BYTES)],
+    'offsets': [0, 8, 9, 16],
+    'itemsize': 16 + RECORD_DATA_BYTES,
+})
+INDEX_DTYPE = np.dtype([('start', '<u8'), ('end', '<u8'), ('t_start', '<f8')])
+
+SIDECAR_COLS = [
+    'index', 'participant_id', 'session', 'block', 'trial', 'recycled', 'start', 'end'
+]
+
+# SDL events to record (keyboard, joystick, and game controller input)
+RECORDED_EVENTS = set([
+    sdl2.SDL_KEYDOWN, sdl2.SDL_KEYUP,
+    sdl2.SDL_JOYAXISMOTION, sdl2.SDL_JOYBUTTONDOWN, sdl2.SDL_JOYBUTTONUP,
+    sdl2.SDL_JOYHATMOTION, sdl2.SDL_JOYDEVICEADDED, sdl2.SDL_JOYDEVICEREMOVED,
+    sdl2.SDL_CONTROLLERAXISMOTION, sdl2.SDL_CONTROLLERBUTTONDOWN,
+    sdl2.SDL_CONTROLLERBUTTONUP, sdl2.SDL_CONTROLLERDEVICEADDED,
+    sdl2.SDL_CONTROLLERDEVICEREMOVED,
+])
+
+
+def read_input_log(path):
+    """Opens a session's raw input log for reading.
+
+    Args:
+        path (str): The path of the log's record file (i.e. the '.bin' file).
+
+    Returns:
+        tuple: Memory-mapped arrays of the log's records (see :obj:`RECORD_DTYPE`)
+        and its index of the (start, end) record numbers and start time of each
+        trial.
+
+    """
+    records = np.memmap(path, dtype=RECORD_DTYPE, mode='r')
+    index = np.memmap(path[:-4] + '.idx', dtype=INDEX_DTYPE, mode='r')
+    return (records, index)
+
+
+
+class InputRecorder(object):
+    """Records raw controller and keyboard input to a binary log for a session.
+
+    Every input event that SDL adds to its event queue (i.e. every event seen by
+    :func:`~klibs.KLEventQueue.pump`) is recorded via an SDL event watch, and raw
+    USB packets can be recorded with :meth:`record_usb` (e.g. by setting the
+    ``recorder`` attribute of a :class:`py360.Controller360`). Each record is a
+    fixed-size entry containing the time it was recorded (on the
+    :func:`time.perf_counter` clock), its source, and its raw bytes (see
+    :obj:`RECORD_DTYPE`).
+
+    Records are appended to the log in three files: the records themselves
+    ('<name>.bin'), an index of the (start, end) record numbers and start time
+    of each trial ('<name>.idx', readable as a memory-mapped array), and a CSV sidecar that
+    identifies the trial for each entry in the index ('<name>.csv')::
+
+       self.recorder = InputRecorder(os.path.join(P.data_dir, 'input'), 'p1_s1')
+       self.recorder.start()
+       ...
+       self.recorder.begin_trial()
+       ...
+       self.recorder.end_trial(participant_id=1, session=1, block=1, trial=1)
+
+    Recycled trials are indexed too (flagged as recycled in the sidecar), so that
+    input leading to a trial being recycled can be found in the log.
+
+    New records are only copied into an in-memory buffer when recorded: writing
+    them to disk is done by a background thread. Any records still buffered are
+    written when the recorder is closed, which happens automatically when Python
+    exits (e.g. after quitting mid-session).
+
+    Args:
+        path (str): The folder to write the log to.
+        name (str): The base file name of the log.
+        chunk_size (int, optional): The number of records to buffer before handing
+            them off to be written. Defaults to 4096.
+
+    """
+    def __init__(self, path, name, chunk_size=4096):
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        self._base = os.path.join(path, name)
+        self._chunk_size = chunk_size
+        self._chunk = np.zeros(chunk_size, dtype=RECORD_DTYPE)
+        self._n = 0
+        self._count = 0
+        self._trial_start = 0
+        self._trial_time = 0.0
+        self._trials = 0
+        self._lock = threading.Lock()
+        self._queue = Queue()
+        self._writer = None
+        self._watch = sdl2.SDL_EventFilter(self._on_event)
+
+    def _on_event(self, userdata, event):
+        # SDL event watch callback: records input events as they're queued
+        if event.contents.type in RECORDED_EVENTS:
+            raw = ctypes.string_at(event, RECORD_DATA_BYTES)
+            self.record(SOURCE_SDL, perf_counter(), raw)
+        return 0
+
+    def _write_loop(self):
+        # Appends buffered records and trial index entries to disk in the background
+        with open(self._base + '.bin', 'ab') as records:
+            while True:
+                item = self._queue.get()
+                if item is None:
+                    break
+                kind, data = item
+                if kind == 'records':
+                    records.write(data.tobytes())
+                    records.flush()
+                elif kind == 'trial':
+                    self._write_trial(*data)
+
+    def _write_trial(self, start, end, t_start, ids):
+        with open(self._base + '.idx', 'ab') as f:
+            f.write(np.array([(start, end, t_start)], dtype=INDEX_DTYPE).tobytes())
+        new_file = not os.path.exists(self._base + '.csv')
+        with open(self._base + '.csv', 'a', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=SIDECAR_COLS)
+            if new_file:
+                writer.writeheader()
+            row = dict(ids)
+            row.update({'recycled': int(row.get('recycled', False)), 'start': start, 'end': end})
+            writer.writerow(row)
+
+    def _flush(self):
+        # Hands the current chunk of records off to the writer thread
+        if self._n:
+            self._queue.put(('records', self._chunk[:self._n].copy()))
+            self._n = 0
+
+    def start(self):
+        """Starts recording input events.
+
+        """
+        # Continue the trial index from any previous runs of the same session
+        if os.path.exists(self._base + '.bin'):
+            self._count = os.path.getsize(self._base + '.bin') // RECORD_DTYPE.itemsize
+        if os.path.exists(self._base + '.idx'):
+            self._trials = os.path.getsize(self._base + '.idx') // INDEX_DTYPE.itemsize
+        self._trial_start = self._count
+        self._writer = threading.Thread(target=self._write_loop, daemon=True)
+        self._writer.start()
+        sdl2.SDL_AddEventWatch(self._watch, None)
+        atexit.register(self.close)
+
+    def record(self, source, t, data):
+        """Adds a record to the log.
+
+        Args:
+            source (int): The source of the record (e.g. ``SOURCE_USB``).
+            t (float): The time of the record (on the :func:`time.perf_counter`
+                clock).
+            data (bytes): The raw data for the record. Data longer than
+                ``RECORD_DATA_BYTES`` is truncated.
+
+        """
+        size = min(len(data), RECORD_DATA_BYTES)
+        with self._lock:
+            rec = self._chunk[self._n]
+            rec['time'] = t
+            rec['source'] = source
+            rec['size'] = size
+            rec['data'][:size] = np.frombuffer(bytes(data[:size]), dtype=np.uint8)
+            rec['data'][size:] = 0
+            self._n += 1
+            self._count += 1
+            if self._n == self._chunk_size:
+                self._flush()
+
+    def record_usb(self, t, data):
+        """Adds a raw USB packet to the log.
+
+        Args:
+            t (float): The time the packet was received.
+            data (bytes): The raw packet.
+
+        """
+        self.record(SOURCE_USB, t, data)
+
+    def begin_trial(self):
+        """Marks the start of a trial's records.
+
+        """
+        with self._lock:
+            self._trial_start = self._count
+            self._trial_time = perf_counter()
+
+    def end_trial(self, recycled=False, **ids):
+        """Marks the end of a trial's records, adding the trial to the log's index.
+
+        Args:
+            recycled (bool, optional): Whether the trial was recycled. Defaults to
+                False.
+            **ids: The columns identifying the trial in the database (i.e.
+                participant_id, session, block, and trial).
+
+        Returns:
+            int: The trial's entry number in the log's index.
+
+        """
+        with self._lock:
+            index = self._trials
+            ids.update({'index': index, 'recycled': recycled})
+            self._flush()
+            trial = (self._trial_start, self._count, self._trial_time, ids)
+            self._queue.put(('trial', trial))
+            self._trials += 1
+            self._trial_start = self._count
+        return index
+
+    def close(self):
+        """Stops recording and finishes writing the log to disk.
+
+        """
+        if self._writer is None:
+            return
+        atexit.unregister(self.close)
+        sdl2.SDL_DelEventWatch(self._watch, None)
+        with self._lock:
+            self._flush()
+        self._queue.put(None)
+        self._writer.join()
+        self._writer = None
@@ -0,0 +1,253 @@
+"""Generation, streaming, and on-disk caching of the coloured noise used by the
+experiment.
+
+By default, noise is streamed (see :class:`PinkNoiseStream`), so nothing needs
+to be synthesized at startup. When looping clips are used instead, each session
+gets its own seeded clips, which are stored as ``.npy`` files so that relaunching
+the same session (e.g. after a crash) memory-maps them instead of synthesizing
+them again. Since clips differ between sessions, the cache can't be built ahead
+of time. To empty it, run::
+
+   python ExpAssets/Resources/code/noise.py clear
+
+"""
+
+import os
+import sys
+
+import numpy as np
+import colorednoise
+
+
+# Default audio format for SDL_mixer is signed 16-bit integer
+INT16_MAX = np.iinfo(np.int16).max
+
+SAMPLE_RATE = 22050 # samples per channel per second
+
+STREAM_LEVEL = 0.2 # RMS amplitude of streamed noise (roughly that of the cached clips)
+
+DEFAULT_CACHE_DIR = os.path.normpath(
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "noise_cache")
+)
+DEFAULT_CACHE_SIZE = 64 # MB
+
+
+def pink_noise(duration, sample_rate=SAMPLE_RATE, stereo=False, seed=None, exponent=1.0):
+    """Generates a clip of 1/f^exponent noise as 16-bit stereo audio.
+
+    Args:
+        duration (float): The seconds of noise to generate.
+        sample_rate (int, optional): The number of samples per channel per second.
+        stereo (bool, optional): If True, generates different noise streams for
+            the left and right channels. If False, the left and right channel
+            noise will be identical. Defaults to False.
+        seed (int, optional): The seed to use for generating the noise. Defaults
+            to None (random seed).
+        exponent (float, optional): The exponent of the noise's power spectrum
+            (0 = white noise, 1 = pink noise, 2 = brown noise). Defaults to 1.0.
+
+    Returns:
+        :obj:`numpy.ndarray`: A C-contiguous (samples, 2) int16 array of the
+        interleaved left/right channel samples.
+
+    """
+    size = int(duration * sample_rate)
+    channels = 2 if stereo else 1
+    rng = np.random.default_rng(seed)
+    arr = colorednoise.powerlaw_psd_gaussian(exponent, (channels, size), random_state=rng)
+    arr = (arr / np.abs(arr).max(axis=1, keepdims=True)) * INT16_MAX
+    arr = arr.astype(np.int16).T
+    if not stereo:
+        arr = np.repeat(arr, 2, axis=1)
+    return np.ascontiguousarray(arr)
+
+
+
+class PinkNoiseStream(object):
+    """An endless, non-repeating stream of 1/f^exponent noise.
+
+    Unlike :func:`pink_noise`, which synthesizes a whole clip at once, noise
+    streams generate their samples in small blocks as they are read, so streams
+    of any length use a constant amount of memory and require no synthesis at
+    startup. Noise is generated by filtering Gaussian white noise through a
+    truncated fractional-integration filter (Kasdin, 1995) using overlap-save
+    FFT convolution, which works for any spectral exponent. Below roughly
+    ``sample_rate / taps`` Hz, the spectrum flattens out.
+
+    Args:
+        sample_rate (int, optional): The number of samples per channel per second.
+        stereo (bool, optional): If True, generates different noise streams for
+            the left and right channels. If False, the left and right channel
+            noise will be identical. Defaults to False.
+        seed (int, optional): The seed to use for generating the noise. Defaults
+            to None (random seed).
+        exponent (float, optional): The exponent of the noise's power spectrum
+            (0 = white noise, 1 = pink noise, 2 = brown noise). Defaults to 1.0.
+        level (float, optional): The RMS amplitude of the noise, where 1.0 is
+            full scale. Samples exceeding full scale are clipped. Defaults to 0.2.
+        taps (int, optional): The length of the noise filter. Defaults to 8192.
+
+    """
+    def __init__(self, sample_rate=SAMPLE_RATE, stereo=False, seed=None,
+                 exponent=1.0, level=STREAM_LEVEL, taps=8192):
+        self.sample_rate = sample_rate
+        self.stereo = stereo
+        self._channels = 2 if stereo else 1
+        self._rng = np.random.default_rng(seed)
+        self._taps = taps
+        self._fft_size = 2 * taps
+
+        # Build the frequency response of the fractional-integration filter
+        h = np.ones(taps)
+        k = np.arange(1, taps)
+        h[1:] = np.cumprod((k - 1 + exponent / 2.0) / k)
+        self._gain = level / np.sqrt(np.sum(h ** 2))
+        self._response = np.fft.rfft(h, self._fft_size)
+
+        # Prime the filter with white noise so the stream starts in a steady state
+        self._history = self._rng.standard_normal((self._channels, taps - 1))
+        self._pending = np.zeros((0, self._channels), dtype=np.float32)
+
+    def _next_block(self):
+        # Generates the next block of noise using overlap-save convolution
+        n = self._fft_size - (self._taps - 1)
+        white = self._rng.standard_normal((self._channels, n))
+        x = np.concatenate([self._history, white], axis=1)
+        self._history = x[:, n:]
+        y = np.fft.irfft(np.fft.rfft(x, axis=1) * self._response, self._fft_size)
+        y = y[:, (self._taps - 1):] * self._gain
+        return np.clip(y, -1.0, 1.0).astype(np.float32).T
+
+    def read(self, frames):
+        """Reads the next chunk of noise from the stream.
+
+        Args:
+            frames (int): The number of samples per channel to read.
+
+        Returns:
+            :obj:`numpy.ndarray`: A (frames, 2) float32 array of left/right channel
+            samples, ranging from -1.0 to 1.0.
+
+        """
+        chunks = [self._pending]
+        available = len(self._pending)
+        while available < frames:
+            block = self._next_block()
+            chunks.append(block)
+            available += len(block)
+        buf = np.concatenate(chunks) if len(chunks) > 1 else self._pending
+        out, self._pending = buf[:frames], buf[frames:]
+        if not self.stereo:
+            out = np.repeat(out, 2, axis=1)
+        return out
+
+
+
+class NoiseCache(object):
+    """A size-capped on-disk cache of generated noise clips.
+
+    Clips are keyed by their duration, sample rate, stereo-ness, seed, and
+    spectral exponent, and are stored as ``.npy`` files that are memory-mapped
+    when loaded (i.e. they are paged in from disk rather than copied into memory).
+    When the total size of the cache exceeds the size limit, the least-recently
+    used clips are removed until it fits again.
+
+    Only clips requested with a seed are cached: clips requested without one
+    are generated fresh with a random seed every time, so that they never repeat
+    across sessions.
+
+    Args:
+        path (str, optional): The folder in which to store cached clips. Defaults
+            to 'ExpAssets/Resources/noise_cache'.
+        max_size (float, optional): The maximum size of the cache (in MB).
+            Defaults to 64.
+
+    """
+    def __init__(self, path=DEFAULT_CACHE_DIR, max_size=DEFAULT_CACHE_SIZE):
+        self.path = path
+        self.max_size = max_size
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+
+    def _filename(self, duration, sample_rate, stereo, seed, exponent):
+        fname = "pink_{0:g}s_{1}hz_{2}_seed-{3}_exp-{4:g}.npy".format(
+            duration, int(sample_rate), "stereo" if stereo else "mono",
+            int(seed), exponent
+        )
+        return os.path.join(self.path, fname)
+
+    def _cached_files(self):
+        files = []
+        for f in os.listdir(self.path):
+            if f.startswith("pink_") and f.endswith(".npy"):
+                files.append(os.path.join(self.path, f))
+        return files
+
+    def _write(self, fpath, arr):
+        # Write to a temporary file first so a crash never leaves a partial clip
+        tmp = fpath[:-4] + ".tmp.npy"
+        np.save(tmp, arr)
+        os.replace(tmp, fpath)
+
+    def load(self, duration, sample_rate=SAMPLE_RATE, stereo=False, seed=None, exponent=1.0):
+        """Loads a noise clip from the cache, generating it first if needed.
+
+        See :func:`pink_noise` for a description of the arguments.
+
+        Returns:
+            :obj:`numpy.memmap`: A read-only (samples, 2) int16 array of the
+            interleaved left/right channel samples. If no seed is given, the clip
+            is not cached and a regular array is returned instead.
+
+        """
+        if seed is None:
+            return pink_noise(duration, sample_rate, stereo, seed, exponent)
+        fpath = self._filename(duration, sample_rate, stereo, seed, exponent)
+        if os.path.isfile(fpath):
+            # Update the modification time so eviction is least-recently-used
+            os.utime(fpath, None)
+        else:
+            self._write(fpath, pink_noise(duration, sample_rate, stereo, seed, exponent))
+            self.evict(keep=[fpath])
+        return np.load(fpath, mmap_mode='r')
+
+    def evict(self, keep=()):
+        """Removes the least-recently used clips until the cache fits its size limit.
+
+        Args:
+            keep (list, optional): Paths of clips that should never be removed.
+
+        """
+        files = []
+        for f in self._cached_files():
+            try:
+                files.append((os.path.getmtime(f), os.path.getsize(f), f))
+            except OSError:
+                pass # removed by another thread/process since listing
+        files.sort()
+        total = sum(size for _, size, _ in files)
+        max_bytes = self.max_size * 1024 * 1024
+        for _, size, f in files:
+            if total <= max_bytes:
+                break
+            if f in keep:
+                continue
+            total -= size
+            try:
+                os.remove(f)
+            except OSError:
+                pass
+
+    def clear(self):
+        """Removes all clips from the cache.
+
+        """
+        for f in self._cached_files():
+            os.remove(f)
+
+
+if __name__ == "__main__":
+    if sys.argv[1:] == ["clear"]:
+        NoiseCache().clear()
+    else:
+        print("Usage: python noise.py clear")
@@ -2,6 +2,7 @@
 # Constants for pyusb
 PAD_CONFIG = 0
 CTRL_INTERFACE = (0, 0)
+READ_TIMEOUT = 100 # ms
 
 # Input packet length/format
 PACKET_BYTES = 20
@@ -1,11 +1,18 @@
 import os
+import threading
+from collections import deque
+from time import perf_counter
 
+import numpy as np
 import usb
 import usb.backend.libusb1
 import libusb_package as usbdll
 
 from .constants import *
-from .parsing import InputPacket, parse_data_packet, get_events
+from .parsing import (
+    InputPacket, ButtonEvent, PACKET_DTYPE, PACKET_HEADER, parse_data_packets,
+    get_button_edges
+)
 
     
 # Configure pyusb to use binary from libusb-package
@@ -25,20 +32,44 @@ def get_controllers():
 
 
 class Controller360(object):
+    """An Xbox 360 controller read directly over USB.
 
+    Input packets are read from the controller by a background thread as soon
+    as they arrive, timestamped (on the :func:`time.perf_counter` clock), and
+    queued until the next call to :meth:`update`, which processes them without
+    blocking. As such, the rate at which controller input is sampled does not
+    depend on how often :meth:`update` is called.
+
+    If the controller's ``recorder`` attribute is set to an object with a
+    ``record_usb(t, data)`` method (e.g. an :class:`inputlog.InputRecorder`),
+    every packet received is passed to it when processed by :meth:`update`.
+
+    Args:
+        usb_device: The PyUSB device object for the controller.
+
+    """
     def __init__(self, usb_device):
         self._dev = usb_device
         usb_id = '{0}:{1}'.format(self._dev.idVendor, self._dev.idProduct)
         self.name = VALID_IDS[usb_id]
         
         self._data = []
+        self._times = []
         self._events = []
+        self._event_times = []
         self._last_data = InputPacket(0, 0, 0, 0, 0, 0, 0)
+        self._packets = deque()
+        self._arrived = threading.Condition()
+        self._reading = False
+        self._reader = None
+        self.read_error = None
+        self.recorder = None
 
         usb.util.claim_interface(self._dev, 0)
         self._dev.set_configuration()
         self._pad_in = self._dev[PAD_CONFIG][CTRL_INTERFACE][0]
         self._pad_out = self._dev[PAD_CONFIG][CTRL_INTERFACE][1]
+        self._start_reader()
 
     def __del__(self):
         if self._dev is not None:
@@ -47,6 +78,54 @@ class Controller360(object):
             except:
                 pass
         
+    def _start_reader(self):
+        self._reading = True
+        self._reader = threading.Thread(target=self._read_loop, daemon=True)
+        self._reader.start()
+
+    def _stop_reader(self):
+        self._reading = False
+        if self._reader and self._reader is not threading.current_thread():
+            self._reader.join()
+        self._reader = None
+
+    def _read_loop(self):
+        # Continuously reads packets from the controller on a background thread,
+        # timestamping each packet as soon as it arrives
+        while self._reading:
+            try:
+                data = self._pad_in.read(32, timeout=READ_TIMEOUT)
+            except usb.core.USBTimeoutError:
+                continue
+            except usb.core.USBError as e:
+                # If the controller has been unplugged or can't be read, stop reading
+                self.read_error = e
+                self._reading = False
+                with self._arrived:
+                    self._arrived.notify_all()
+                break
+            with self._arrived:
+                self._packets.append((perf_counter(), bytearray(data)))
+                self._arrived.notify_all()
+
+    def wait(self, timeout):
+        """Waits until new packets have arrived from the controller.
+
+        Returns immediately if there are already packets waiting to be processed
+        by :meth:`update`.
+
+        Args:
+            timeout (float): The maximum time (in seconds) to wait.
+
+        Returns:
+            bool: True if there are new packets, otherwise False.
+
+        """
+        with self._arrived:
+            if not self._packets and self._reading:
+                self._arrived.wait(timeout)
+            return len(self._packets) > 0
+
     def _send_cmd(self, cmd):
         self._pad_out.write(cmd, timeout=0)
 
@@ -58,29 +137,53 @@ class Controller360(object):
         self._send_cmd(cmd)
         
     def update(self):
-        data = None
-        while True:
-            try:
-                data = self._pad_in.read(32, timeout=5)
-                break
-            except usb.core.USBError:
-                break
-        if data is not None:
-            new = bytearray(data)
-            if new[:2] == b'\x00\x14':
-                p = parse_data_packet(new)
-                self._data.append(p)
-                self._events += get_events(self._last_data, p)
-                self._last_data = p
-
-    def get_data(self):
-        dat = self._data
+        # Process all packets received since the last update at once, without
+        # blocking
+        times, raw = ([], [])
+        while self._packets:
+            t, new = self._packets.popleft()
+            if self.recorder:
+                self.recorder.record_usb(t, new)
+            if new[:2] == PACKET_HEADER:
+                times.append(t)
+                raw.append(bytes(new[:PACKET_BYTES]))
+        if not raw:
+            return
+        packets = parse_data_packets(b"".join(raw))
+        self._data.append(packets)
+        self._times += times
+        idx, buttons, states = get_button_edges(self._last_data.buttons, packets['buttons'])
+        self._events += [ButtonEvent(int(b), int(s)) for b, s in zip(buttons, states)]
+        self._event_times += [times[i] for i in idx]
+        self._last_data = InputPacket(*packets[-1].tolist())
+
+    def get_data(self, timestamps=False):
+        """Gets the input packets received since the last call.
+
+        Args:
+            timestamps (bool, optional): If True, returns the times at which the
+                packets were received as well. Defaults to False.
+
+        Returns:
+            :obj:`numpy.ndarray`: A structured array of the packets, with the same
+            fields as :class:`InputPacket`. If timestamps are requested, a
+            (times, packets) tuple is returned instead.
+
+        """
+        dat = np.concatenate(self._data) if self._data else np.zeros(0, PACKET_DTYPE)
+        times = np.asarray(self._times, dtype=np.float64)
         self._data = []
+        self._times = []
+        if timestamps:
+            return (times, dat)
         return dat
 
-    def get_button_events(self):
+    def get_button_events(self, timestamps=False):
         events = self._events
+        if timestamps:
+            events = list(zip(self._event_times, events))
         self._events = []
+        self._event_times = []
         return events
 
     def left_stick(self):
@@ -100,5 +203,6 @@ class Controller360(object):
         return int(self._last_data.buttons & bit > 0)
 
     def disconnect(self):
+        self._stop_reader()
         usb.util.release_interface(self._dev, 0)
         self._dev = None
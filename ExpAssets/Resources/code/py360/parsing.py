@@ -1,6 +1,8 @@
 import struct
 from collections import namedtuple
 
+import numpy as np
+
 from .constants import *
 
 
@@ -13,6 +15,16 @@ InputPacket = namedtuple(
 ButtonEvent = namedtuple('Button', ['name', 'state'])
 AxisEvent = namedtuple('Axis', ['name', 'value'])
 
+# NumPy equivalent of PACKET_STRUCT for parsing many packets at once, with the
+# same fields (in the same order) as InputPacket
+PACKET_DTYPE = np.dtype({
+    'names': ['buttons', 'lt', 'rt', 'lx', 'ly', 'rx', 'ry'],
+    'formats': ['<u2', 'u1', 'u1', '<i2', '<i2', '<i2', '<i2'],
+    'offsets': [2, 4, 5, 6, 8, 10, 12],
+    'itemsize': PACKET_BYTES,
+})
+PACKET_HEADER = b'\x00\x14'
+
 
 # Parses an input packet from the controller into useful values
 def parse_data_packet(raw):
@@ -20,6 +32,18 @@ def parse_data_packet(raw):
     return InputPacket(*parsed)
 
 
+# Parses a buffer of concatenated input packets into a structured array
+def parse_data_packets(raw):
+    n = len(raw) // PACKET_BYTES
+    if n == 0:
+        return np.zeros(0, dtype=PACKET_DTYPE)
+    raw = np.frombuffer(raw, dtype=np.uint8, count=n * PACKET_BYTES)
+    # Drop any packets that aren't input packets
+    headers = raw.reshape(n, PACKET_BYTES)[:, :2]
+    valid = (headers[:, 0] == PACKET_HEADER[0]) & (headers[:, 1] == PACKET_HEADER[1])
+    return raw.view(PACKET_DTYPE)[valid]
+
+
 def parse_buttons(buttonmask):
     pressed = []
     for b in ALL_BUTTONS:
@@ -47,3 +71,16 @@ def get_events(old, new):
                 events.append(ButtonEvent(b, pressed))
 
     return events
+
+
+# Gets the button presses/releases for a series of button masks, relative to the
+# mask before the series. Returns arrays of packet indices, buttons, and states.
+def get_button_edges(last_mask, masks):
+    buttons = np.asarray(ALL_BUTTONS, dtype=np.uint16)
+    masks = np.asarray(masks, dtype=np.uint16)
+    previous = np.concatenate(([last_mask], masks[:-1])).astype(np.uint16)
+    changed = masks ^ previous
+    edges = (changed[:, np.newaxis] >> buttons) & 1
+    idx, col = np.nonzero(edges)
+    states = (masks[idx] >> buttons[col]) & 1
+    return (idx, buttons[col], states)
@@ -0,0 +1,328 @@
+import time
+import ctypes
+import threading
+from time import perf_counter
+
+import numpy as np
+import sdl2
+from klibs.KLConstants import TIMEOUT
+
+from inputlog import SOURCE_SDL, RECORD_DATA_BYTES, read_input_log
+
+# Layout of an SDL_ControllerAxisEvent, for building synthetic events in bulk
+_AXIS_EVENT_DTYPE = np.dtype({
+    'names': ['type', 'timestamp', 'which', 'axis', 'value'],
+    'formats': ['<u4', '<u4', '<i4', 'u1', '<i2'],
+    'offsets': [0, 4, 8, 12, 16],
+    'itemsize': RECORD_DATA_BYTES,
+})
+
+
+class ReplaySource(object):
+    """A stream of recorded or synthetic SDL input events, for replaying input.
+
+    A replay source can be used in place of :func:`~klibs.KLEventQueue.pump`
+    to feed events to any code that checks an event queue (e.g.
+    :func:`gamepad.button_pressed` or :meth:`KLGamepad.TriggerListener.listen`)::
+
+       source = ReplaySource.from_input_log('p1_s1_input.bin', trial=3)
+       response, rt = collect(self.resp_listener, source)
+
+    Events are released by :meth:`pump` once the replay clock reaches their
+    times. In real-time mode, the replay clock follows the system clock. Otherwise,
+    the clock advances by a fixed step on every call to :meth:`pump`, so events
+    are replayed as fast as possible and the results of processing them are
+    exactly the same on every run. Either way, the timestamps of replayed
+    events are on the replay clock (see :meth:`ticks`).
+
+    Args:
+        times (:obj:`numpy.ndarray`): The times of the events (in ms, relative
+            to the start of the replay), in ascending order.
+        events (:obj:`numpy.ndarray`): An (n, 56) uint8 array of the raw bytes of
+            each SDL event.
+        realtime (bool, optional): Whether to replay events in real time.
+            Defaults to False.
+        step (int, optional): The number of ms the replay clock advances on each
+            pump when not replaying in real time. Defaults to 1.
+
+    """
+    def __init__(self, times, events, realtime=False, step=1):
+        order = np.argsort(times, kind='stable')
+        self._times = np.asarray(times, dtype=np.int64)[order]
+        self._events = np.array(events, dtype=np.uint8)[order]
+        # Stamp each event with its time on the replay clock
+        self._events.view(_AXIS_EVENT_DTYPE)['timestamp'][:, 0] = self._times
+        self._realtime = realtime
+        self._step = step
+        self.reset()
+
+    @classmethod
+    def from_input_log(cls, path, trial, realtime=False, step=1):
+        """Creates a replay source from a trial in a recorded input log.
+
+        Args:
+            path (str): The path of the log's record file (see
+                :class:`inputlog.InputRecorder`).
+            trial (int): The index of the trial in the log to replay.
+            realtime (bool, optional): Whether to replay events in real time.
+                Defaults to False.
+            step (int, optional): The number of ms the replay clock advances on
+                each pump when not replaying in real time. Defaults to 1.
+
+        Returns:
+            :obj:`ReplaySource`: A replay source for the trial's SDL events.
+
+        """
+        records, index = read_input_log(path)
+        start, end, t_start = index[trial]
+        trial_records = records[int(start):int(end)]
+        trial_records = trial_records[trial_records['source'] == SOURCE_SDL]
+        times = np.round((trial_records['time'] - t_start) * 1000)
+        return cls(times, trial_records['data'], realtime, step)
+
+    @classmethod
+    def from_triggers(cls, times, lt, rt, which=0, realtime=False, step=1):
+        """Creates a replay source of synthetic trigger motion events.
+
+        An axis motion event is created for each trigger every time its value
+        changes, so millions of samples can be generated cheaply.
+
+        Args:
+            times (:obj:`numpy.ndarray`): The times of the trigger samples (in ms).
+            lt (:obj:`numpy.ndarray`): The raw left trigger values (0 to 32767).
+            rt (:obj:`numpy.ndarray`): The raw right trigger values (0 to 32767).
+            which (int, optional): The instance ID of the controller the events
+                should come from. Defaults to 0.
+            realtime (bool, optional): Whether to replay events in real time.
+                Defaults to False.
+            step (int, optional): The number of ms the replay clock advances on
+                each pump when not replaying in real time. Defaults to 1.
+
+        Returns:
+            :obj:`ReplaySource`: A replay source for the trigger events.
+
+        """
+        times = np.asarray(times, dtype=np.int64)
+        all_times, all_events = ([], [])
+        axes = (
+            (sdl2.SDL_CONTROLLER_AXIS_TRIGGERLEFT, np.asarray(lt, dtype=np.int16)),
+            (sdl2.SDL_CONTROLLER_AXIS_TRIGGERRIGHT, np.asarray(rt, dtype=np.int16)),
+        )
+        for axis, values in axes:
+            changed = np.concatenate(([values[0] != 0], values[1:] != values[:-1]))
+            events = np.zeros(int(changed.sum()), dtype=_AXIS_EVENT_DTYPE)
+            events['type'] = sdl2.SDL_CONTROLLERAXISMOTION
+            events['which'] = which
+            events['axis'] = axis
+            events['value'] = values[changed]
+            all_times.append(times[changed])
+            all_events.append(events.view(np.uint8).reshape(-1, RECORD_DATA_BYTES))
+        return cls(np.concatenate(all_times), np.concatenate(all_events), realtime, step)
+
+    @classmethod
+    def from_keys(cls, times, keys, realtime=False, step=1):
+        """Creates a replay source of synthetic key press events.
+
+        Args:
+            times (:obj:`numpy.ndarray`): The times of the key presses (in ms).
+            keys (list): The names of the keys pressed (e.g. 'z').
+            realtime (bool, optional): Whether to replay events in real time.
+                Defaults to False.
+            step (int, optional): The number of ms the replay clock advances on
+                each pump when not replaying in real time. Defaults to 1.
+
+        Returns:
+            :obj:`ReplaySource`: A replay source for the key press events.
+
+        """
+        events = np.zeros((len(keys), RECORD_DATA_BYTES), dtype=np.uint8)
+        for i, key in enumerate(keys):
+            e = sdl2.SDL_Event()
+            e.type = sdl2.SDL_KEYDOWN
+            e.key.state = sdl2.SDL_PRESSED
+            e.key.keysym.sym = sdl2.SDL_GetKeyFromName(key.encode('utf-8'))
+            e.key.keysym.scancode = sdl2.SDL_GetScancodeFromKey(e.key.keysym.sym)
+            raw = ctypes.string_at(ctypes.byref(e), RECORD_DATA_BYTES)
+            events[i] = np.frombuffer(raw, dtype=np.uint8)
+        return cls(np.asarray(times, dtype=np.int64), events, realtime, step)
+
+    def reset(self):
+        """Restarts the replay from the beginning.
+
+        """
+        self._next = 0
+        self._now = 0
+        self._start = perf_counter()
+
+    def ticks(self):
+        """Gets the current time on the replay clock.
+
+        Returns:
+            int: The time (in ms) since the start of the replay.
+
+        """
+        if self._realtime:
+            return int((perf_counter() - self._start) * 1000)
+        return self._now
+
+    def pump(self):
+        """Gets all events due since the last pump, as with klibs' ``pump()``.
+
+        Returns:
+            list: A list of :obj:`sdl2.SDL_Event` objects.
+
+        """
+        if not self._realtime:
+            self._now += self._step
+        end = np.searchsorted(self._times, self.ticks(), side='right')
+        raw = self._events[self._next:end]
+        self._next = max(end, self._next)
+        return [sdl2.SDL_Event.from_buffer_copy(e) for e in raw]
+
+    @property
+    def done(self):
+        """bool: Whether all events in the replay have been pumped."""
+        return self._next >= len(self._times)
+
+    def __len__(self):
+        return len(self._times)
+
+
+
+class ReplayFeeder(object):
+    """Feeds the events of a replay source into SDL's event queue in real time.
+
+    Unlike passing a replay source's :meth:`~ReplaySource.pump` to code that
+    checks for input, feeding its events into SDL's queue means that any code
+    reading the queue (e.g. a klibs response listener's ``collect()``) receives
+    them as if they came from a real device. Events are pushed by a background
+    thread as they come due, and are stamped by SDL with the time they were
+    pushed::
+
+       self.feeder = ReplayFeeder()
+       self.feeder.start()
+       ...
+       self.feeder.play(ReplaySource.from_keys([450], ['z'], realtime=True))
+       response, rt = self.resp_listener.collect()
+
+    Args:
+        interval (float, optional): The time (in seconds) between checks for
+            due events. Defaults to 0.001.
+
+    """
+    def __init__(self, interval=0.001):
+        self._interval = interval
+        self._source = None
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._thread = None
+
+    def _feed_loop(self):
+        # Pushes due events from the current source into SDL's queue
+        while not self._stopping.is_set():
+            with self._lock:
+                source = self._source
+                if source is not None:
+                    for e in source.pump():
+                        sdl2.SDL_PushEvent(e)
+                    if source.done:
+                        self._source = None
+            time.sleep(self._interval)
+
+    def start(self):
+        """Starts the background thread that feeds events into SDL's queue.
+
+        """
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._feed_loop, daemon=True)
+        self._thread.start()
+
+    def play(self, source):
+        """Starts feeding a replay source's events into SDL's queue.
+
+        Any events remaining from a previous source are dropped. The source
+        should replay in real time (see :class:`ReplaySource`).
+
+        Args:
+            source (:obj:`ReplaySource`): The source of the events to feed.
+
+        """
+        with self._lock:
+            source.reset()
+            self._source = source
+
+    def stop(self):
+        """Stops feeding events into SDL's queue.
+
+        """
+        if self._thread is None:
+            return
+        self._stopping.set()
+        self._thread.join()
+        self._thread = None
+        self._source = None
+
+
+
+def collect(listener, source, timeout=None):
+    """Collects a response from a response listener using a replay source.
+
+    Works the same as the listener's ``collect()`` method, except that events
+    come from the replay source and the listener is timed on the replay clock.
+
+    Args:
+        listener (:obj:`KLGamepad.TriggerListener`): The listener to collect a
+            response with.
+        source (:obj:`ReplaySource`): The source of the events to replay.
+        timeout (float, optional): The maximum duration (in seconds, on the replay
+            clock) to wait for a response. Defaults to None (until the replay
+            runs out of events).
+
+    Returns:
+        tuple: The response label and RT (in ms) of the collected response, or
+        (None, TIMEOUT) if no response was made.
+
+    """
+    clock = listener.clock
+    listener.clock = source.ticks
+    try:
+        listener.init()
+        start = source.ticks()
+        while not source.done:
+            resp = listener.listen(source.pump())
+            if resp:
+                return resp
+            if timeout and source.ticks() - start >= timeout * 1000:
+                break
+    finally:
+        listener.clock = clock
+    return (None, TIMEOUT)
+
+
+def first_event(source, check, until=None):
+    """Finds the first time a check on the replayed event queue succeeds.
+
+    Useful for replaying input through functions that check the event queue for
+    responses (e.g. anticipatory response checks)::
+
+       classifier = EventClassifier(trigger_threshold=0.1)
+       t = first_event(source, lambda q: classifier.classify(q).responses)
+
+    Args:
+        source (:obj:`ReplaySource`): The source of the events to replay.
+        check (callable): A function that takes a list of events and returns
+            True if they contain the input being checked for.
+        until (int, optional): The time (in ms, on the replay clock) to stop
+            checking at. Defaults to None (until the replay runs out of events).
+
+    Returns:
+        int: The time (in ms, on the replay clock) of the first successful check,
+        or None if the check never succeeded.
+
+    """
+    while not source.done:
+        if check(source.pump()):
+            return source.ticks()
+        if until is not None and source.ticks() >= until:
+            break
+    return None
@@ -0,0 +1,115 @@
+from collections import OrderedDict
+
+import numpy as np
+from klibs.KLGraphics import NumpySurface
+from klibs.KLCommunication import message
+
+DIGITS = "0123456789"
+
+
+class TextCache(object):
+    """A cache of rendered text, for avoiding re-rendering the same messages.
+
+    Text is rendered with klibs' :func:`~klibs.KLCommunication.message` the first
+    time it's requested, after which the same surface is reused. Once the cache is
+    full, the least-recently used text is removed to make room for new text::
+
+       self.text = TextCache()
+       ...
+       msg = self.text.message("Press any button to start.")
+
+    Numbers can also be built from a cached set of digit glyphs with
+    :meth:`number`, so that showing a number never requires rendering new text
+    (e.g. for reaction time feedback). Since klibs' text rendering is not
+    thread-safe, the cache should only be used from the main thread.
+
+    Args:
+        max_size (int, optional): The maximum number of rendered messages to
+            keep. Defaults to 256.
+
+    """
+    def __init__(self, max_size=256):
+        self._max_size = max_size
+        self._cache = OrderedDict()
+        self._glyphs = {}
+
+    def _store(self, key, surface):
+        while len(self._cache) >= self._max_size:
+            self._cache.popitem(last=False)
+        self._cache[key] = surface
+        return surface
+
+    def message(self, text, style=None, align="left"):
+        """Renders a message, or retrieves it from the cache if already rendered.
+
+        Args:
+            text (str): The text to render.
+            style (str, optional): The name of the text style to render the text
+                with. Defaults to the default klibs text style.
+            align (str, optional): The justification of multi-line text ('left',
+                'center', or 'right'). Defaults to 'left'.
+
+        Returns:
+            :obj:`NumpySurface`: The rendered text.
+
+        """
+        key = (text, style, align)
+        if key in self._cache:
+            self._cache.move_to_end(key)
+            return self._cache[key]
+        return self._store(key, message(text, style, align=align))
+
+    def glyphs(self, style=None):
+        """Gets the digit glyph atlas for a given text style, rendering it if needed.
+
+        Args:
+            style (str, optional): The name of the text style to render the digits
+                with. Defaults to the default klibs text style.
+
+        Returns:
+            dict: The rendered (height, width, 4) RGBA pixels for each digit.
+
+        """
+        if style not in self._glyphs:
+            atlas = {}
+            for digit in DIGITS:
+                atlas[digit] = np.asarray(message(digit, style).render(), dtype=np.uint8)
+            self._glyphs[style] = atlas
+        return self._glyphs[style]
+
+    def number(self, value, style=None):
+        """Builds a surface for a non-negative whole number from cached digit glyphs.
+
+        Args:
+            value (int): The number to build a surface for.
+            style (str, optional): The name of the text style to use. Defaults to
+                the default klibs text style.
+
+        Returns:
+            :obj:`NumpySurface`: A surface containing the number.
+
+        """
+        text = str(int(value))
+        key = (text, style, None)
+        if key in self._cache:
+            self._cache.move_to_end(key)
+            return self._cache[key]
+        atlas = self.glyphs(style)
+        glyphs = [atlas[digit] for digit in text]
+        height = max(g.shape[0] for g in glyphs)
+        px = np.zeros((height, sum(g.shape[1] for g in glyphs), 4), dtype=np.uint8)
+        x = 0
+        for g in glyphs:
+            px[:g.shape[0], x:(x + g.shape[1])] = g
+            x += g.shape[1]
+        return self._store(key, NumpySurface(px))
+
+    def clear(self):
+        """Removes all rendered text from the cache.
+
+        """
+        self._cache = OrderedDict()
+        self._glyphs = {}
+
+    def __len__(self):
+        return len(self._cache)
@@ -3,6 +3,7 @@ __author__ = "Austin Hurst"
 import os
 import re
 import random
+from time import perf_counter
 
 import klibs
 from klibs.KLConstants import TK_MS, TIMEOUT
@@ -11,20 +12,31 @@ from klibs.KLUtilities import deg_to_px
 from klibs.KLEventQueue import pump, flush
 from klibs.KLUserInterface import any_key, ui_request, key_pressed, smart_sleep
 from klibs.KLGraphics import KLDraw as kld
-from klibs.KLGraphics import fill, flip, blit, clear, NumpySurface
+from klibs.KLGraphics import NumpySurface
 from klibs.KLText import add_text_style
 from klibs.KLExperiment import TrialException
-from klibs.KLCommunication import message
+from klibs.KLCommunication import message, collect_demographics
 from klibs.KLResponseListeners import KeypressListener
 from klibs.KLTime import CountDown
-from klibs.KLAudio import AudioClip
 
 import sdl2
-import numpy as np
-import colorednoise
 
+from noise import NoiseCache, PinkNoiseStream
+from audiostream import StreamPlayer, LoopStream
+from assets import AssetLoader
+from framecache import FrameCache
+from textcache import TextCache
+from display import fill, blit, flip, use_backend, FrameDisplay, FlipLog, FrameSchedule, measure_refresh
+from headless import HeadlessDisplay
+from replay import ReplaySource, ReplayFeeder
+from inputlog import InputRecorder
+from dbwriter import TrialWriter
+from traces import encode_trace
+from inputclock import InputClock
+from inputevents import EventClassifier, InputProfile, wait_for_event
 from gamepad import gamepad_init, button_pressed
-from gamepad_usb import get_all_controllers
+from gamepad_usb import Virtual360Controller
+from devices import DeviceRegistry, HotplugMonitor, DRIVER_SDL, DRIVER_USB
 from KLGamepad import TriggerListener
 
 
@@ -37,6 +49,17 @@ RED = (255, 0, 0, 255)
 class CASTRedux(klibs.Experiment):
 
     def setup(self):
+
+        # If running headless, count drawing operations instead of rendering them,
+        # and respond to trials with scripted key presses so that the session can
+        # run unattended
+        self.headless = None
+        self.feeder = None
+        if P.headless:
+            self.headless = HeadlessDisplay(P.headless_refresh_rate)
+            use_backend(self.headless)
+            self.feeder = ReplayFeeder()
+            self.feeder.start()
         
         # Stimulus sizes
         fixation_size = deg_to_px(0.5)
@@ -51,10 +74,15 @@ class CASTRedux(klibs.Experiment):
         arrow_head_thickness = deg_to_px(0.5)
         arrow_tail_thickness = deg_to_px(0.17)
 
-        # Visual stimuli
+        # Start preparing the fish images in the background so that they load
+        # while demographics are being collected
+        self.assets = AssetLoader()
         fish_path = os.path.join(P.image_dir, 'fish_left_neutral.png')
-        self.fish_l = NumpySurface(fish_path, width=fish_width)
-        self.fish_r = self.fish_l.copy().flip_x()
+        self.assets.submit('fish', load_fish, fish_path, fish_width)
+        self.noise_player = StreamPlayer()
+        rate = self.noise_player.sample_rate
+
+        # Visual stimuli
         self.fixation = kld.FixationCross(fixation_size, fixation_thickness, fill=BLACK)
         self.exo_cue = kld.Ellipse(exo_cue_size, fill=BLACK)
         self.warning_circle = kld.Annulus(
@@ -73,12 +101,96 @@ class CASTRedux(klibs.Experiment):
             arrow_head_width, arrow_head_thickness,
             fill=BLACK,
         )
+        shapes = [
+            self.fixation, self.exo_cue, self.warning_circle, self.warning_square,
+            self.arrow_l, self.arrow_r,
+        ]
+        self.assets.submit('shapes', render_all, shapes)
+
+        # Collect demographics while the above assets are being prepared (filling
+        # them in anonymously if running headless)
+        if P.collect_demographics:
+            collect_demographics(P.development_mode or P.headless)
+
+        # If not streaming noise, start loading the noise clips (seeded per
+        # session, so that each participant hears different noise but relaunching
+        # a session reuses its cached clips)
+        if not P.stream_noise:
+            seed = (P.participant_id * 100 + P.session_number) * 2
+            noise_cache = NoiseCache(max_size=P.noise_cache_size)
+            self.assets.submit(
+                'noise_mono', noise_cache.load, 10.0, rate, stereo=False, seed=seed
+            )
+            self.assets.submit(
+                'noise_stereo', noise_cache.load, 1.0, rate, stereo=True, seed=seed + 1
+            )
+
+        # Font styles & text (rendered in the background during controller setup)
+        add_text_style('incorrect', '0.5deg', RED)
+        add_text_style('block', '0.5deg', line_space=2.6)
+
+        def render_messages():
+            anticipatory = message("Too soon!", 'incorrect')
+            timeout = message("Too slow! Please try to respond more quickly.")
+            return (anticipatory, timeout)
+
+        self.assets.submit('messages', render_messages)
+
+        # If connected, try initializing game controller (using the registry of
+        # known devices to skip pointless USB scans), then keep watching for
+        # controllers being connected or disconnected (unless running headless, in
+        # which case scripted responses come from the keyboard)
+        gamepad_init()
+        self.gamepad = None
+        self.devices = DeviceRegistry()
+        controllers = [] if self.headless else self.devices.find_controllers()
+        if len(controllers):
+            self.gamepad = controllers[0]
+            self.gamepad.initialize()
+        self.hotplug = HotplugMonitor(self.devices)
+        if not self.headless:
+            self.hotplug.start(self.gamepad)
+
+        # If enabled, stop SDL from queueing input events the experiment never uses
+        # (in development mode, dropped events are counted by type)
+        self.input_profile = None
+        if P.input_profile:
+            self.input_profile = InputProfile(count_all=P.development_mode)
+            self.input_profile.apply()
+
+        # Source of input events for anticipatory response checks (can be replaced
+        # with a replay.ReplaySource's pump for testing response logic offline)
+        self.pump = pump
+        self.classifier = EventClassifier(trigger_threshold=0.1)
+
+        # If enabled, record all raw controller/keyboard input for the session
+        self.recorder = None
+        if P.record_input:
+            log_name = "p{0}_s{1}_input".format(P.participant_id, P.session_number)
+            self.recorder = InputRecorder(os.path.join(P.data_dir, 'input'), log_name)
+            self.recorder.start()
+
+        # If enabled, time controller responses with sub-millisecond resolution
+        self.input_clock = None
+        if P.hires_timing:
+            self.input_clock = InputClock()
+            self.input_clock.start()
+
+        # Set up Response Collector to get keypress responses
+        self.init_response_listener()
+
+        # Auditory stimuli (mixed into a single stream so alerts are sample-accurate)
+        if P.stream_noise:
+            mono = PinkNoiseStream(rate, stereo=False)
+            stereo = PinkNoiseStream(rate, stereo=True)
+        else:
+            mono = LoopStream(self.assets.get('noise_mono'))
+            stereo = LoopStream(self.assets.get('noise_stereo'))
+        self.noise_mono = self.noise_player.add(mono, volume=0.1)
+        self.noise_stereo = self.noise_player.add(stereo, volume=0.1)
 
-        # Auditory stimuli
-        self.noise_mono = PinkNoise(10.0, stereo=False, volume=0.1)
-        self.noise_stereo = PinkNoise(1.0, stereo=True, volume=0.1)
-        
         # Layout
+        self.fish_l, self.fish_r = self.assets.get('fish')
         width_offset = deg_to_px(5.0)
         flanker_pad = deg_to_px(0.2)
         self.left_loc = (P.screen_c[0] - width_offset, P.screen_c[1])
@@ -95,62 +207,59 @@ class CASTRedux(klibs.Experiment):
                 (self.right_loc[0] + x_offset, self.right_loc[1] + y_offset)
             )
 
-        # Font styles & text
-        add_text_style('incorrect', '0.5deg', RED)
-        add_text_style('block', '0.5deg', line_space=2.6)
-        self.anticipatory_msg = message("Too soon!", 'incorrect')
-
-        # If connected, try initializing game controller
-        gamepad_init()
-        self.gamepad = None
-        controllers = get_all_controllers()
-        if len(controllers):
-            self.gamepad = controllers[0]
-            self.gamepad.initialize()
-
-        # Set up Response Collector to get keypress responses
-        if self.gamepad:
-            print("Using gamepad")
-            self.resp_listener = TriggerListener(
-                mapping = {'Left': 'left', 'Right': 'right'},
-                gamepad = self.gamepad,
-                threshold = 0.5,
-                timeout = P.response_timeout / 1000
-            )
-        else:
-            print("Using keyboard")
-            self.resp_listener = KeypressListener(
-                keymap = {'z': 'left', '/': 'right'},
-                timeout = P.response_timeout / 1000
-            )
-
         # Initialize feedback messages for practice block
-        timeout_msg = message(
-            "Too slow! Please try to respond more quickly."
-        )
-        controls = "pull the trigger" if self.gamepad else "press the key"
-        incorrect_msg = message(
-            "Incorrect response!\n"
-            "Please {} on the same side the middle fish is facing.".format(controls),
-            align='center'
-        )
-        self.feedback_msgs = {'incorrect': incorrect_msg, 'timeout': timeout_msg}
+        self.anticipatory_msg, timeout_msg = self.assets.get('messages')
+        self.feedback_msgs = {'incorrect': None, 'timeout': timeout_msg}
+        self.init_incorrect_msg()
+
+        # Initialize cache of rendered text, pre-rendering digits for RT feedback
+        self.text = TextCache()
+        self.text.glyphs()
+        self.assets.get('shapes')
+        self.assets.shutdown()
+
+        # Initialize cache of pre-composed trial displays
+        self.frames = FrameCache(P.default_fill_color, backend=self.headless)
+        self.display = FrameDisplay(self.frames, reuse_buffers=P.reuse_back_buffers)
+        self.flip_log = FlipLog()
+
+        # Estimate the refresh interval of the display for scheduling stimulus onsets
+        self.refresh_ms = measure_refresh()
+
+        # If enabled, keep trial data in memory and only write it to the database
+        # at breaks and block ends, so disk writes don't lengthen the ITI
+        self.trial_writer = None
+        if P.buffer_trial_data:
+            self.trial_writer = TrialWriter(
+                P.database_path, tables=('trials', 'frame_timing')
+            )
+            self.trial_writer.wrap(self.db, default_table=P.primary_table)
 
         # Generate blocks of trials based on custom block structure
         self.last_block_type = None
         self.was_practicing = False
         self.block_number = 0
 
-        if not P.skip_demos:
+        if not (P.skip_demos or self.headless):
             self.general_demo()
 
 
     def block(self):
 
+        # Write any buffered trial data from the previous block to the database
+        if self.trial_writer:
+            self.trial_writer.flush()
+
+        # If a controller has been connected or disconnected, switch to it (or back
+        # to the keyboard). This only happens between blocks, so that the response
+        # device never changes partway through a block.
+        if not self.headless and self.hotplug.poll():
+            self.switch_input_device()
+
         # If this is the first block of a subtask, run its demo instructions
         if self.last_block_type != self.block_label:
             self.block_number += 1
-            if not P.skip_demos:
+            if not (P.skip_demos or self.headless):
                 if self.block_label == "exo":
                     self.exo_demo()
                 elif self.block_label == "endo":
@@ -163,7 +272,7 @@ class CASTRedux(klibs.Experiment):
                 "This is a practice block.\n"
                 "During this block you will be given feedback for your responses."
             )
-            block_msg = message(header, 'block', align="center")
+            block_msg = self.text.message(header, 'block', align="center")
         elif self.was_practicing or self.last_block_type != self.block_label:
             # If first non-practice block of subtest, show block start message
             header = "Block {0} of {1}\n".format(self.block_number, 4)
@@ -172,7 +281,7 @@ class CASTRedux(klibs.Experiment):
                 header += "brief flashes."
             else:
                 header += "arrows."
-            block_msg = message(header, 'block', align='center')
+            block_msg = self.text.message(header, 'block', align='center')
         self.last_block_type = self.block_label
         self.was_practicing = P.practicing
 
@@ -180,12 +289,10 @@ class CASTRedux(klibs.Experiment):
             message_interval = CountDown(1)
             while message_interval.counting():
                 ui_request() # Allow quitting during loop
-                fill()
-                blit(block_msg, 8, (P.screen_c[0], P.screen_y*0.4))
-                flip()
+                self.display.show([(block_msg, (P.screen_c[0], P.screen_y*0.4), 8)])
             flush()
             
-            start_msg = message("Press any button to start.")
+            start_msg = self.text.message("Press any button to start.")
             fill()
             blit(block_msg, 8, (P.screen_c[0], P.screen_y*0.4))
             blit(start_msg, 5, [P.screen_c[0], P.screen_y*0.7])
@@ -197,7 +304,7 @@ class CASTRedux(klibs.Experiment):
 
 
     def trial_prep(self):
-        
+
         # Determine location of target and flankers
         if self.target_location == "left":
             self.target_loc = self.left_loc
@@ -232,82 +339,99 @@ class CASTRedux(klibs.Experiment):
             onset_delay_sec = random.expovariate(fix_lambda) + P.fix_interval_min
         self.onset_delay = int(onset_delay_sec * 1000) # Convert to msec
         
-        # Add timecourse of events to EventManager
+        # Add timecourse of events to the schedule, with each event presented on the
+        # refresh closest to its intended onset
         self.soa = 200 if self.trial_type == "exo" else 1000
-        self.evm.add_event('warning_on', self.onset_delay)
-        self.evm.add_event('warning_off', 100, after='warning_on')
-        self.evm.add_event('target_on', self.soa, after='warning_on')
+        self.schedule = FrameSchedule(self.flip_log, self.refresh_ms)
+        self.schedule.add_event('warning_on', self.onset_delay)
+        self.schedule.add_event('warning_off', 100, after='warning_on')
+        self.schedule.add_event('target_on', self.soa, after='warning_on')
 
         # Pause background noise and give participant a break every 24 trials
         if P.trial_number > 1 and ((P.trial_number - 1) % 24) == 0:
             self.show_break_prompt()
 
+        # Pre-compose the displays for each phase of the trial (if not cached already)
+        fixation = self.fixation_layers()
+        target = [(self.target, self.target_loc)]
+        if self.flanker:
+            target += [(self.flanker, loc) for loc in self.flanker_locs]
+        self.trial_frames = {
+            'fixation': fixation,
+            'cue': fixation + self.cue_layers(),
+            'target': fixation + target,
+        }
+        for layers in self.trial_frames.values():
+            self.frames.add(layers)
+
         # Start trial with stereo noise muted & mono noise on low volume
         self.init_background_noise()
 
 
     def trial(self):
-        
-        # Before warning onset, show fixation
-        while self.evm.before('warning_on'):
-            self.check_anticipatory()
-            fill()
-            self.draw_fixation()
-            flip()
 
-        # Initiate auditory alerting cue (if present for trial)
+        # Start logging the timing of every flip (and raw input) during the trial
+        if self.recorder:
+            self.recorder.begin_trial()
+        trial_start = perf_counter()
+        self.flip_log.start(trial_start)
+
+        # Get the stereo volume of the auditory alerting cue (if present for trial)
+        alert_volume = None
         if self.trial_type == 'exo':
-            if self.alerting_trial:
-                self.noise_stereo.volume = 1.0
-            else:
-                self.noise_stereo.volume = 0.1
-            self.noise_mono.volume = 0.0
-        elif self.trial_type == 'endo':
-            if self.alerting_trial:
-                self.noise_stereo.volume = 0.1
-                self.noise_mono.volume = 0.0
+            alert_volume = 1.0 if self.alerting_trial else 0.1
+        elif self.trial_type == 'endo' and self.alerting_trial:
+            alert_volume = 0.1
         
-        # Wait until the end of the warning period, then return noise to normal
-        while self.evm.before('warning_off'):
-            self.check_anticipatory()
-            fill()
-            self.draw_fixation()
-            if self.trial_type == 'exo':
-                self.draw_cues()
-            flip()
-        self.noise_mono.volume = 0.1
-        self.noise_stereo.volume = 0.0
-
-        while self.evm.before('target_on'):
-            self.check_anticipatory()
-            fill()
-            self.draw_fixation()
-            flip()
+        # NOTE: The flip log is always stopped on leaving this block (even if the
+        # trial is recycled), so that later screens aren't logged with the trial
+        try:
+            # Before warning onset, show fixation. Once the first flip has been
+            # logged, schedule the alert in advance for the predicted warning flip
+            # so that its onset is sample-accurate and matches the visual warning
+            while self.schedule.before('warning_on'):
+                self.check_anticipatory()
+                self.display.show(self.trial_frames['fixation'])
+                if alert_volume is not None:
+                    warning_onset = self.schedule.predict('warning_on')
+                    if warning_onset is not None:
+                        self.schedule_alert(alert_volume, onset=warning_onset)
+                        alert_volume = None
+            if alert_volume is not None:
+                # If the warning is the first flip of the trial, play the alert now
+                self.schedule_alert(alert_volume, onset=self.schedule.predict('warning_on'))
+
+            # Wait until the end of the warning period
+            while self.schedule.before('warning_off'):
+                self.check_anticipatory()
+                self.display.show(self.trial_frames['cue'])
+
+            while self.schedule.before('target_on'):
+                self.check_anticipatory()
+                self.display.show(self.trial_frames['fixation'])
         
-        # Draw target stimuli/flankers and enter response collection loop
-        fill()
-        self.draw_fixation()
-        blit(self.target, 5, self.target_loc)
-        if self.flanker_type != "none":
-            for loc in self.flanker_locs:
-                blit(self.flanker, 5, loc)
-        flip()
+            # Draw target stimuli/flankers and enter response collection loop
+            self.display.show(self.trial_frames['target'])
+        finally:
+            self.flip_log.stop()
+        if self.input_clock:
+            # Measure RTs from the time of the target flip
+            self.resp_listener.onset_time = self.flip_log.flip_time('target_on')
+        if self.feeder:
+            self.feeder.play(self.scripted_response())
         response, rt = self.resp_listener.collect()
         
         # If using gamepad, get max/final pressure on non-response trigger during the
         # response period as a measure of response competition
-        nonresp_max, trig_max_l, trig_max_r = (0, 0, 0)
-        nonresp_last, trig_last_l, trig_last_r = (0, 0, 0)
+        nonresp_max, nonresp_last, nonresp_auc, nonresp_onset = (0, 0, 0, 'NA')
         if self.gamepad:
-            for trig in self.resp_listener.raw_data:
-                if trig.left > trig_max_l:
-                    trig_max_l = trig.left
-                if trig.right > trig_max_r:
-                    trig_max_r = trig.right
-                trig_last_l = trig.left
-                trig_last_r = trig.right
-            nonresp_max = trig_max_r if response == 'left' else trig_max_l
-            nonresp_last = trig_last_r if response == 'left' else trig_last_l
+            trig = self.resp_listener.summary
+            nonresp = 'right' if response == 'left' else 'left'
+            nonresp_max = trig[nonresp + '_max']
+            nonresp_last = trig[nonresp + '_last']
+            nonresp_auc = trig[nonresp + '_auc']
+            if trig[nonresp + '_onset'] is not None:
+                nonresp_onset = trig[nonresp + '_onset']
 
         # Prepare response values for database
         accuracy = int(response == self.target_direction)
@@ -317,6 +441,8 @@ class CASTRedux(klibs.Experiment):
             rt = 'NA'
             nonresp_max = 'NA'
             nonresp_last = 'NA'
+            nonresp_auc = 'NA'
+            nonresp_onset = 'NA'
         
         # If practice trial, show participant feedback for bad responses
         if P.practicing and response != self.target_direction:
@@ -330,22 +456,57 @@ class CASTRedux(klibs.Experiment):
         
         # Otherwise, clear screen immediately after response and wait for trial end
         else:
-            msg = "Too slow!" if rt == 'NA' else str(int(rt))
-            feedback = message(msg)
+            if rt == 'NA':
+                feedback = self.text.message("Too slow!")
+            else:
+                feedback = self.text.number(rt)
 
             feedback_interval = CountDown(P.feedback_duration)
             while feedback_interval.counting():
                 ui_request()
-                fill()
-                blit(feedback, 5, P.screen_c)
-                flip()
+                self.display.show([(feedback, P.screen_c)])
         
+        # Log the actual vs. scheduled onsets and frame timing for the trial
+        timing = self.flip_log.summary({
+            'warning_on': self.onset_delay,
+            'warning_off': self.onset_delay + 100,
+            'target_on': self.onset_delay + self.soa,
+        })
+        soa_delivered = self.schedule.delivered('target_on', since='warning_on')
+        timing.update({
+            'participant_id': P.participant_id,
+            'session': P.session_number,
+            'block': P.block_number,
+            'trial': P.trial_number,
+        })
+        self.db.insert(timing, table='frame_timing')
+
+        # If enabled, store the full raw trigger trace for the trial (linked to the
+        # trial's row in the database when buffering trial data)
+        if self.gamepad and P.store_trigger_traces:
+            samples = self.resp_listener.raw_data
+            trace = {
+                'participant_id': P.participant_id,
+                'session': P.session_number,
+                'block': P.block_number,
+                'trial': P.trial_number,
+                'samples': len(samples),
+                'trace': encode_trace(samples),
+            }
+            if self.trial_writer:
+                self.trial_writer.attach(trace, table='trigger_traces')
+            else:
+                self.db.insert(trace, table='trigger_traces')
+        if self.recorder:
+            self.end_input_trial()
+
         # Log recorded trial data to database
         return {
             "session": P.session_number,
             "block": P.block_number,
             "trial": P.trial_number,
             "practice": P.practicing,
+            "input_device": self.input_device(),
             "trial_type": self.trial_type,
             "alerting_trial": self.alerting_trial, 
             "cue_type": self.cue_type,
@@ -354,24 +515,120 @@ class CASTRedux(klibs.Experiment):
             "flanker_type": self.flanker_type,
             "onset_delay": self.onset_delay,
             "soa": self.soa,
+            "soa_delivered": round(soa_delivered, 2),
             "response": response,
             "accuracy": accuracy,
             "rt": rt,
             "nonresp_max": nonresp_max,
             "nonresp_last": nonresp_last,
+            "nonresp_auc": nonresp_auc,
+            "nonresp_onset": nonresp_onset,
         }
 
     
     def clean_up(self):
-        msg = message("You're all done!  Press any button to exit.")
+        if self.trial_writer:
+            self.trial_writer.close()
+
+        # Remove the noise player's audio callback before klibs closes the mixer
+        self.noise_player.close()
+        msg = self.text.message("You're all done!  Press any button to exit.")
         fill()
         blit(msg, 5, P.screen_c)
         flip()
         wait_for_input(gamepad=self.gamepad)
+        self.hotplug.stop()
+        if self.feeder:
+            self.feeder.stop()
+        if self.recorder:
+            self.recorder.close()
+
+        # If filtering input events, print how many were dropped
+        if self.input_profile:
+            self.input_profile.remove()
+            print("Filtered input events: {0}".format(self.input_profile.filtered))
+            for event_type, count in sorted(self.input_profile.counts.items()):
+                print("  type {0}: {1}".format(event_type, count))
+
+        # If running headless, print a summary of the per-frame drawing costs
+        if self.headless:
+            for stat, value in self.headless.report().items():
+                print("{0}: {1}".format(stat, value))
+
+
+    def init_response_listener(self):
+        # Sets up the response listener for the current controller (or for the
+        # keyboard if there isn't one)
+        if isinstance(self.gamepad, Virtual360Controller):
+            self.gamepad.usb_pad.recorder = self.recorder
+            self.gamepad.input_clock = self.input_clock
+        if self.gamepad:
+            print("Using gamepad")
+            self.resp_listener = TriggerListener(
+                mapping = {'Left': 'left', 'Right': 'right'},
+                gamepad = self.gamepad,
+                threshold = 0.5,
+                timeout = P.response_timeout / 1000,
+                input_clock = self.input_clock
+            )
+        else:
+            print("Using keyboard")
+            self.resp_listener = KeypressListener(
+                keymap = {'z': 'left', '/': 'right'},
+                timeout = P.response_timeout / 1000
+            )
+
+
+    def scripted_response(self):
+        # Scripts a key press response to the target for running headless, with
+        # a plausible RT and the correct direction on most trials
+        rt = max(random.gauss(450, 100), 150)
+        response = self.target_direction
+        if random.random() < 0.1:
+            response = 'right' if response == 'left' else 'left'
+        key = {'left': 'z', 'right': '/'}[response]
+        return ReplaySource.from_keys([int(rt)], [key], realtime=True)
+
+
+    def input_device(self):
+        # Gets the device used for responses: the keyboard or a controller (and
+        # how the controller was found)
+        if not self.gamepad:
+            return 'keyboard'
+        return DRIVER_USB if isinstance(self.gamepad, Virtual360Controller) else DRIVER_SDL
+
+
+    def switch_input_device(self):
+        # Switches to the controller picked up by the hotplug monitor (or back to
+        # the keyboard), then shows the response instructions for the new device
+        self.gamepad = self.hotplug.gamepad
+        self.init_response_listener()
+        self.init_incorrect_msg()
+        if self.gamepad:
+            header = "A game controller has been connected."
+            controls = "Please respond using the left and right triggers."
+        else:
+            header = "The game controller has been disconnected."
+            controls = "Please respond using the z (left) and / (right) keys."
+        msg1 = self.text.message(header)
+        msg2 = self.text.message(controls + "\nPress any button to continue.", align="center")
+        wait_msg(msg1, msg2, self.display, gamepad=self.gamepad)
+
+
+    def init_incorrect_msg(self):
+        # Renders the feedback message for incorrect responses, with instructions
+        # for the current input device
+        controls = "pull the trigger" if self.gamepad else "press the key"
+        self.feedback_msgs['incorrect'] = message(
+            "Incorrect response!\n"
+            "Please {} on the same side the middle fish is facing.".format(controls),
+            align='center'
+        )
 
 
     def init_background_noise(self):
         # Start playback with stereo noise muted & mono noise on low volume
+        # (cancelling any scheduled alerts)
         self.noise_mono.volume = 0.1
         self.noise_stereo.volume = 0.0
         if not self.noise_mono.playing:
@@ -379,55 +636,98 @@ class CASTRedux(klibs.Experiment):
             self.noise_stereo.play(loop=True)
 
 
-    def draw_fixation(self):
+    def schedule_alert(self, stereo_volume, onset=None, duration=0.1):
+        # Schedule a switch from mono to stereo noise at the given stereo volume,
+        # returning the noise to normal after the given duration (in seconds)
+        if onset is None:
+            onset = perf_counter()
+        self.noise_stereo.set_volume(stereo_volume, at=onset)
+        self.noise_mono.set_volume(0.0, at=onset)
+        self.noise_mono.set_volume(0.1, at=onset + duration)
+        self.noise_stereo.set_volume(0.0, at=onset + duration)
+
+
+    def fixation_layers(self):
+        # Get the stimuli to draw at the center of the screen for the trial
+        layers = []
         if self.trial_type == 'exo':
-            blit(self.fixation, 5, P.screen_c)
+            layers.append((self.fixation, P.screen_c))
         elif self.trial_type == 'endo':
             if self.alerting_trial:
-                blit(self.warning_circle, 5, P.screen_c)
+                layers.append((self.warning_circle, P.screen_c))
             else:
-                blit(self.warning_square, 5, P.screen_c)
+                layers.append((self.warning_square, P.screen_c))
             if self.cue_type == 'valid':
                 arrow = self.arrow_l if self.target_location == 'left' else self.arrow_r
-                blit(arrow, 5, P.screen_c)
+                layers.append((arrow, P.screen_c))
             if self.cue_type == 'invalid':
                 arrow = self.arrow_r if self.target_location == 'left' else self.arrow_l
-                blit(arrow, 5, P.screen_c)
+                layers.append((arrow, P.screen_c))
             elif self.cue_type == 'none':
                 pass
+        return layers
 
 
-    def draw_cues(self):
+    def cue_layers(self):
+        # Get the exogenous cue to draw during the warning period (if any)
+        layers = []
+        if self.trial_type != 'exo':
+            return layers
         if self.cue_type == 'valid':
             loc = self.left_loc if self.target_location == 'left' else self.right_loc
-            blit(self.exo_cue, 5, loc)
+            layers.append((self.exo_cue, loc))
         if self.cue_type == 'invalid':
             loc = self.right_loc if self.target_location == 'left' else self.left_loc
-            blit(self.exo_cue, 5, loc)
+            layers.append((self.exo_cue, loc))
         elif self.cue_type == 'none':
             pass
+        return layers
 
     
     def check_anticipatory(self):
         # If any response before target onset, display error & recycle trial
-        q = pump()
-        ui_request(queue=q)
-        if key_pressed(queue=q) or button_pressed(q) or trigger_pressed(q):
+        events = self.classifier.classify(self.pump())
+        if events.ui:
+            ui_request(queue=events.ui)
+        if events.responses:
+            self.flip_log.stop() # Don't log the feedback as part of the trial
+            self.init_background_noise() # Cancel the upcoming alert
             feedback_interval = CountDown(P.feedback_duration)
             while feedback_interval.counting():
                 ui_request()
-                fill()
-                blit(self.anticipatory_msg, 5, P.screen_c)
-                flip()
+                self.display.show([(self.anticipatory_msg, P.screen_c)])
+            if self.recorder:
+                self.end_input_trial(recycled=True)
             raise TrialException("Recycling trial!")
 
 
+    def end_input_trial(self, recycled=False):
+        # Add the trial to the raw input log's index and, if buffering trial data,
+        # link the index entry to the trial's row in the database (recycled trials
+        # have no row, so theirs are written unlinked)
+        ids = {
+            'participant_id': P.participant_id,
+            'session': P.session_number,
+            'block': P.block_number,
+            'trial': P.trial_number,
+        }
+        log_index = self.recorder.end_trial(recycled=recycled, **ids)
+        if self.trial_writer:
+            entry = dict(ids, log_index=log_index, recycled=recycled)
+            if recycled:
+                self.trial_writer.insert(entry, table='input_trials')
+            else:
+                self.trial_writer.attach(entry, table='input_trials')
+
+
     def show_break_prompt(self):
+        if self.trial_writer:
+            self.trial_writer.flush()
         self.noise_mono.stop()
         self.noise_stereo.stop()
-        msg1 = message("Take a break!")
-        msg2 = message("Whenever you're ready, press any button to continue.")
-        wait_msg(msg1, msg2, gamepad=self.gamepad)
+        msg1 = self.text.message("Take a break!")
+        msg2 = self.text.message("Whenever you're ready, press any button to continue.")
+        wait_msg(msg1, msg2, self.display, gamepad=self.gamepad)
         self.init_background_noise()
 
 
@@ -441,7 +741,7 @@ class CASTRedux(klibs.Experiment):
             msg_y = int(P.screen_y * 0.15)
             msgs = [msgs]
         for msg in msgs:
-            txt = message(msg, align="center")
+            txt = self.text.message(msg, align="center")
             blit(txt, 8, (msg_x, msg_y))
             msg_y += txt.height + half_space
     
@@ -458,8 +758,8 @@ class CASTRedux(klibs.Experiment):
     
     def sound_demo(self):
         self.init_background_noise()
-        msg1 = message("Use the following buttons to demo the alerting sounds:")
-        msg2 = message(
+        msg1 = self.text.message("Use the following buttons to demo the alerting sounds:")
+        msg2 = self.text.message(
             ("(X) - Play the high-intensity noise change\n"
              "(Y) - Play the same-intensity noise change\n"
              "(A) - Continue the experiment"),
@@ -472,25 +772,18 @@ class CASTRedux(klibs.Experiment):
 
         done = False
         while not done:
+            wait_for_event(gamepad=self.gamepad)
             if self.gamepad:
                 self.gamepad.update()
             q = pump()
 
             if button_or_key_pressed(q, "x"):
                 # Demo loud alerting signal
-                self.noise_stereo.volume = 1.0
-                self.noise_mono.volume = 0.0
-                smart_sleep(100)
-                self.noise_mono.volume = 0.1
-                self.noise_stereo.volume = 0.0
+                self.schedule_alert(1.0)
 
             elif button_or_key_pressed(q, "y"):
                 # Demo isointense alerting signal
-                self.noise_stereo.volume = 0.1
-                self.noise_mono.volume = 0.0
-                smart_sleep(100)
-                self.noise_mono.volume = 0.1
-                self.noise_stereo.volume = 0.0
+                self.schedule_alert(0.1)
             
             elif button_or_key_pressed(q, "a"):
                 done = True
@@ -528,7 +821,7 @@ class CASTRedux(klibs.Experiment):
             ["Please try to respond quickly and accurately to the best of your ability.",
              ("Once you make a response, your reaction time will be shown\n"
              "briefly on the screen to let you know how you did.")],
-            [(message("359"), P.screen_c)]
+            [(self.text.number(359), P.screen_c)]
         )
         self.init_background_noise()
         self.show_demo_text(
@@ -573,22 +866,16 @@ class CASTRedux(klibs.Experiment):
              "Press any button to hear an example."],
             [(self.fixation, P.screen_c)],
         )
-        self.noise_stereo.volume = 1.0
-        self.noise_mono.volume = 0.0
+        self.schedule_alert(1.0)
         demo_exo_cue(right=True)
-        self.noise_mono.volume = 0.1
-        self.noise_stereo.volume = 0.0
         self.show_demo_text(
             [("On other trials, the noise change will be the same volume as the "
               "background noise."),
              "Press any button to hear an example."],
             [(self.fixation, P.screen_c)],
         )
-        self.noise_stereo.volume = 0.1
-        self.noise_mono.volume = 0.0
+        self.schedule_alert(0.1)
         demo_exo_cue()
-        self.noise_mono.volume = 0.1
-        self.noise_stereo.volume = 0.0
         self.show_demo_text(
             ["Instructions complete!",
              ("Press (X) to repeat the instructions, (B) to hear the alerting sounds\n"
@@ -597,6 +884,7 @@ class CASTRedux(klibs.Experiment):
         )
         done = False
         while not done:
+            wait_for_event(gamepad=self.gamepad)
             if self.gamepad:
                 self.gamepad.update()
             q = pump()
@@ -638,11 +926,8 @@ class CASTRedux(klibs.Experiment):
              "Press any button to hear an example."],
             [(self.warning_circle, P.screen_c), (self.arrow_l, P.screen_c)]
         )
-        self.noise_stereo.volume = 0.1
-        self.noise_mono.volume = 0.0
+        self.schedule_alert(0.1)
         smart_sleep(100)
-        self.noise_mono.volume = 0.1
-        self.noise_stereo.volume = 0.0
         self.show_demo_text(
             ["On other trials, the arrow will be surrounded by a square.",
              "This means that you will not be alerted when the fish is about to appear."],
@@ -656,6 +941,7 @@ class CASTRedux(klibs.Experiment):
         )
         done = False
         while not done:
+            wait_for_event(gamepad=self.gamepad)
             if self.gamepad:
                 self.gamepad.update()
             q = pump()
@@ -670,35 +956,17 @@ class CASTRedux(klibs.Experiment):
 
 
 
-class PinkNoise(AudioClip):
-    """An audio clip containing randomly-generated pink noise.
+def load_fish(path, width):
+    # Loads and scales the left-facing fish image, creating a right-facing copy
+    fish_l = NumpySurface(path, width=width)
+    fish_r = fish_l.copy().flip_x()
+    return (fish_l, fish_r)
 
-    Args:
-        duration (float): The seconds of noise to generate.
-        stereo (bool, optional): If True, generates different noise streams for
-            the left and right channels. If False, the left and right channel
-            noise will be identical. Defaults to False.
-        volume (float, optional): The volume of the audio clip. Defaults to 1.0
-            (max volume).
 
-    """
-    
-    def __init__(self, duration, stereo=False, volume=1.0):
-        left = self.generate_channel(duration)
-        right = self.generate_channel(duration) if stereo else left
-        noise = np.c_[left, right]
-        super(PinkNoise, self).__init__(noise, volume)
-        
-    def generate_channel(self, duration):
-        max_int = (2 ** 17) - 1 # 32767, which is the max/min value for a signed 16-bit int
-        dtype = np.int16 # Default audio format for SDL_mixer is signed 16-bit integer
-        sample_rate = 44100 / 2 # sample rate for each channel is 22050 kHz, so 44100 total.
-        size = int(duration * sample_rate)
-        
-        arr = colorednoise.powerlaw_psd_gaussian(1.0, size)
-        arr = (arr / max(abs(arr))) * max_int 
-        
-        return arr.astype(dtype)
+def render_all(shapes):
+    # Pre-renders a list of shapes so they're ready to blit
+    for shape in shapes:
+        shape.render()
 
 
 def button_or_key_pressed(events, key=None):
@@ -712,8 +980,12 @@ def wait_for_input(gamepad=None):
         sdl2.SDL_CONTROLLERBUTTONDOWN,
     ]
     flush()
+    if P.headless:
+        # Nobody is there to respond when running headless, so just continue
+        return
     user_input = False
     while not user_input:
+        wait_for_event(gamepad=gamepad)
         if gamepad:
             gamepad.update()
         q = pump()
@@ -724,29 +996,13 @@ def wait_for_input(gamepad=None):
                 break
 
 
-def trigger_pressed(queue, threshold=0.1):
-    valid_axes = [
-        sdl2.SDL_CONTROLLER_AXIS_TRIGGERLEFT,
-        sdl2.SDL_CONTROLLER_AXIS_TRIGGERRIGHT,
-    ]
-    pressed = False
-    for e in queue:
-        if e.type == sdl2.SDL_CONTROLLERAXISMOTION:
-            if e.caxis.axis in valid_axes:
-                if (e.caxis.value / 32767.0) > threshold:
-                    pressed = True
-                    break
-    return pressed
-
-
-def wait_msg(msg1, msg2, delay=1.0, gamepad=None):
+def wait_msg(msg1, msg2, display, delay=1.0, gamepad=None):
     # Show first part of message and wait for the delay
     message_interval = CountDown(delay)
+    display.show([(msg1, (P.screen_c[0], P.screen_y*0.4), 8)])
     while message_interval.counting():
+        wait_for_event(message_interval.remaining())
         ui_request() # Allow quitting during loop
-        fill()
-        blit(msg1, 8, (P.screen_c[0], P.screen_y*0.4))
-        flip()
     flush()
     
     # Show the second part of the message and wait for input
@@ -0,0 +1,128 @@
+import os
+import sys
+from collections import namedtuple
+
+import numpy as np
+import pytest
+
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+import sdl2
+
+CODE_DIR = os.path.join(os.path.dirname(__file__), os.pardir, 'ExpAssets', 'Resources', 'code')
+sys.path.insert(0, os.path.abspath(CODE_DIR))
+
+from gamepad import GameController
+from gamepad_usb import Virtual360Controller
+from py360.constants import BUTTON_A
+from py360.parsing import PACKET_DTYPE, ButtonEvent
+
+
+class FakeUSBPad(object):
+    # Stands in for a py360.Controller360, returning a fixed batch of packets
+    def __init__(self, times, packets, button_events):
+        self._times = times
+        self._packets = packets
+        self._button_events = button_events
+        self.read_error = False
+
+    def update(self):
+        pass
+
+    def get_data(self, timestamps=False):
+        times, packets = (np.asarray(self._times), self._packets)
+        self._times, self._packets = ([], np.zeros(0, PACKET_DTYPE))
+        return (times, packets) if timestamps else packets
+
+    def get_button_events(self, timestamps=False):
+        events, self._button_events = (self._button_events, [])
+        return events if timestamps else [e for t, e in events]
+
+
+def _pump():
+    # Gets all events currently in SDL's queue
+    sdl2.SDL_PumpEvents()
+    events = []
+    e = sdl2.SDL_Event()
+    while sdl2.SDL_PollEvent(e) == 1:
+        events.append(e)
+        e = sdl2.SDL_Event()
+    return events
+
+
+def _batch():
+    # A batch of five packets with the left trigger moving on each, the stick
+    # moving on each, and the A button pressed on the third
+    packets = np.zeros(5, dtype=PACKET_DTYPE)
+    packets['lt'] = [50, 100, 150, 200, 250]
+    packets['lx'] = [10, 20, 30, 40, 50]
+    packets['buttons'][2:] = 1 << BUTTON_A
+    times = [1.0, 1.001, 1.002, 1.003, 1.004]
+    return (times, packets, [(times[2], ButtonEvent(BUTTON_A, 1))])
+
+
+@pytest.fixture
+def pad():
+    sdl2.SDL_Init(sdl2.SDL_INIT_GAMECONTROLLER | sdl2.SDL_INIT_EVENTS)
+    pad = Virtual360Controller(None)
+    GameController.initialize(pad)
+    pad.usb_pad = FakeUSBPad(*_batch())
+    _pump()
+    yield pad
+    pad.usb_pad = None
+    pad.close()
+    sdl2.SDL_Quit()
+
+
+def _trigger_values(events):
+    lt = sdl2.SDL_CONTROLLER_AXIS_TRIGGERLEFT
+    return [
+        e.caxis.value for e in events
+        if e.type == sdl2.SDL_CONTROLLERAXISMOTION and e.caxis.axis == lt
+    ]
+
+
+def test_every_trigger_packet_is_injected(pad):
+    pad.update()
+    events = _pump()
+    values = _trigger_values(events)
+    assert len(values) == 5
+    assert values == sorted(set(values))
+    # Sticks are only injected for the latest packet
+    lx = sdl2.SDL_CONTROLLER_AXIS_LEFTX
+    sticks = [e for e in events if e.type == sdl2.SDL_CONTROLLERAXISMOTION and e.caxis.axis == lx]
+    assert [e.caxis.value for e in sticks] == [50]
+
+
+def test_buttons_are_injected_with_their_packet(pad):
+    pad.update()
+    order = []
+    for e in _pump():
+        if e.type == sdl2.SDL_CONTROLLERBUTTONDOWN:
+            order.append('A')
+        elif e.type == sdl2.SDL_CONTROLLERAXISMOTION:
+            if e.caxis.axis == sdl2.SDL_CONTROLLER_AXIS_TRIGGERLEFT:
+                order.append(e.caxis.value)
+    assert order.index('A') == 3 # after the third packet's trigger motion
+
+
+def test_listener_keeps_every_trigger_sample(pad):
+    pytest.importorskip('klibs')
+    from KLGamepad import TriggerListener
+    listener = TriggerListener({'Left': 'left'}, gamepad=pad, threshold=1.0)
+    listener.init()
+    pad.usb_pad = FakeUSBPad(*_batch())
+    # All packets are pushed within the same ms, so share an SDL timestamp
+    listener.listen(_pump()) # injects the batch
+    listener.listen(_pump())
+    assert len(listener.buffer) == 5
+    lt = list(listener.raw_data['lt'])
+    assert lt == sorted(set(lt))
+
+
+def test_close_removes_virtual_joystick(pad):
+    count = sdl2.SDL_NumJoysticks()
+    pad.usb_pad = None
+    pad.close()
+    assert sdl2.SDL_NumJoysticks() == count - 1
+    pad.close() # closing twice is harmless
+    assert sdl2.SDL_NumJoysticks() == count - 1
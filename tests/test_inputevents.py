@@ -0,0 +1,64 @@
+import os
+import sys
+
+import pytest
+
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+import sdl2
+
+CODE_DIR = os.path.join(os.path.dirname(__file__), os.pardir, 'ExpAssets', 'Resources', 'code')
+sys.path.insert(0, os.path.abspath(CODE_DIR))
+
+from inputevents import InputProfile, EventClassifier
+
+
+def _pump():
+    # Gets all events currently in SDL's queue
+    sdl2.SDL_PumpEvents()
+    events = []
+    e = sdl2.SDL_Event()
+    while sdl2.SDL_PollEvent(e) == 1:
+        events.append(e)
+        e = sdl2.SDL_Event()
+    return events
+
+
+@pytest.fixture
+def controller():
+    # Attaches a virtual game controller and opens it with SDL
+    sdl2.SDL_Init(sdl2.SDL_INIT_GAMECONTROLLER | sdl2.SDL_INIT_EVENTS)
+    index = sdl2.SDL_JoystickAttachVirtual(
+        sdl2.SDL_JOYSTICK_TYPE_GAMECONTROLLER, 6, 15, 0
+    )
+    assert index >= 0, sdl2.SDL_GetError()
+    pad = sdl2.SDL_GameControllerOpen(index)
+    stick = sdl2.SDL_GameControllerGetJoystick(pad)
+    _pump()
+    yield stick
+    sdl2.SDL_GameControllerClose(pad)
+    sdl2.SDL_JoystickDetachVirtual(index)
+    sdl2.SDL_Quit()
+
+
+@pytest.mark.parametrize('count_all', [False, True])
+def test_profile_keeps_controller_events(controller, count_all):
+    profile = InputProfile(count_all=count_all)
+    profile.apply()
+    try:
+        sdl2.SDL_JoystickSetVirtualAxis(controller, sdl2.SDL_CONTROLLER_AXIS_TRIGGERLEFT, 32767)
+        sdl2.SDL_JoystickSetVirtualAxis(controller, sdl2.SDL_CONTROLLER_AXIS_LEFTX, 20000)
+        sdl2.SDL_JoystickSetVirtualButton(controller, sdl2.SDL_CONTROLLER_BUTTON_A, 1)
+        sdl2.SDL_JoystickUpdate()
+        events = _pump()
+    finally:
+        profile.remove()
+
+    types = [e.type for e in events]
+    axes = [e.caxis.axis for e in events if e.type == sdl2.SDL_CONTROLLERAXISMOTION]
+    assert sdl2.SDL_CONTROLLERBUTTONDOWN in types
+    assert axes == [sdl2.SDL_CONTROLLER_AXIS_TRIGGERLEFT]
+    assert profile.counts == {sdl2.SDL_CONTROLLERAXISMOTION: 1}
+
+    classified = EventClassifier().classify(events)
+    assert len(classified.buttons) == 1
+    assert len(classified.triggers) == 1